@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List, Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
-from aiogram.types import InlineKeyboardButton
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from ...config import config
 from ...db.queries import Customer
@@ -36,11 +37,41 @@ def _family_text(lang: str, tm: TranslationManager) -> str:
     return f"Family · {config.price_family}₽"
 
 
+def _start_tier(customer: Customer) -> Tuple[bool, bool, bool]:
+    """The only customer facts the start keyboard depends on: trial, connect and admin buttons."""
+    show_trial = customer.subscription_link is None and config.trial_days > 0
+    show_connect = bool(
+        customer.subscription_link and customer.expire_at and customer.expire_at > datetime.utcnow()
+    )
+    show_admin = customer.telegram_id in config.notify_telegram_ids or (
+        config.admin_telegram_id > 0 and customer.telegram_id == config.admin_telegram_id
+    )
+    return show_trial, show_connect, show_admin
+
+
 def start_keyboard(customer: Customer, lang: str, tm: TranslationManager) -> List[List[InlineKeyboardButton]]:
+    return _start_rows(lang, tm, *_start_tier(customer))
+
+
+@lru_cache(maxsize=256)
+def _start_markup(
+    lang: str, tm: TranslationManager, show_trial: bool, show_connect: bool, show_admin: bool
+) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=_start_rows(lang, tm, show_trial, show_connect, show_admin))
+
+
+def start_markup(customer: Customer, lang: str, tm: TranslationManager) -> InlineKeyboardMarkup:
+    # aiogram markups are immutable, so one instance per tier can be shared between users.
+    return _start_markup(lang, tm, *_start_tier(customer))
+
+
+def _start_rows(
+    lang: str, tm: TranslationManager, show_trial: bool, show_connect: bool, show_admin: bool
+) -> List[List[InlineKeyboardButton]]:
     keyboard: List[List[InlineKeyboardButton]] = []
 
     # Trial always first and single
-    if customer.subscription_link is None and config.trial_days > 0:
+    if show_trial:
         keyboard.append(
             [InlineKeyboardButton(text=tm.get_text(lang, "trial_button"), callback_data="trial")]
         )
@@ -54,7 +85,7 @@ def start_keyboard(customer: Customer, lang: str, tm: TranslationManager) -> Lis
             icon_custom_emoji_id=_button_emoji_id(lang, tm, "buy_button"),
         )
     ]
-    if customer.subscription_link and customer.expire_at and customer.expire_at > datetime.utcnow():
+    if show_connect:
         row_main.append(_connect_buttons(lang, tm)[0])
     keyboard.append(row_main)
 
@@ -124,9 +155,7 @@ def start_keyboard(customer: Customer, lang: str, tm: TranslationManager) -> Lis
     if row_misc:
         keyboard.append(row_misc)
 
-    if customer.telegram_id in config.notify_telegram_ids or (
-        config.admin_telegram_id > 0 and customer.telegram_id == config.admin_telegram_id
-    ):
+    if show_admin:
         keyboard.append(
             [
                 InlineKeyboardButton(
@@ -6,9 +6,11 @@ import logging
 import math
 import random
 import re
+import secrets
 import string
 from datetime import date, datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 from urllib.parse import quote_plus
 from zoneinfo import ZoneInfo
 
@@ -41,7 +43,7 @@ from ...db.queries import (
 )
 from ...services.business import PaymentService, SyncService, StatsService
 from ...services.translation import TranslationManager
-from ..keyboards.inline import payment_methods_keyboard, price_keyboard, start_keyboard
+from ..keyboards.inline import payment_methods_keyboard, price_keyboard, start_markup
 from ..middlewares import EnsureCustomerMiddleware, SuspiciousUserMiddleware
 
 logger = logging.getLogger(__name__)
@@ -108,6 +110,20 @@ CallbackAdminGift = "admin_gift"
 CallbackAdminGiftDuration = "admin_gift_duration"
 CallbackAdminGiftTag = "admin_gift_tag"
 
+# Admin identities are fixed after Config.load; bind them once for the per-update admin checks.
+_ADMIN_ID = config.admin_telegram_id if config.admin_telegram_id > 0 else None
+_NOTIFY_IDS = config.notify_telegram_ids
+
+FOREVER_EXPIRE_AT = datetime(2099, 12, 31, 23, 59, 59)
+
+_BUTTON_URL_RE = re.compile(r"(?:https?|tg)://[^\s<>\"']{1,2048}\Z", re.IGNORECASE)
+
+_PROMO_ALPHABET = string.ascii_uppercase + string.digits
+_PROMO_CODE_CHARS = frozenset(_PROMO_ALPHABET + "-_")
+
+_BACK_SELL_FMT = CallbackSell + "?month=%d&amount=%d"
+_BACK_DUO_FMT = CallbackDuoMembers + "?month=%d"
+
 PRICE_FIELD_ORDER = [
     "price_1",
     "price_3",
@@ -140,6 +156,66 @@ PRICE_FIELD_LABELS = {
     "topup_50_price_stars": "TopUp 50GB (Stars)",
 }
 
+_PRICE_FIELD_LABELS_HTML = {key: html.escape(label) for key, label in PRICE_FIELD_LABELS.items()}
+
+_LOG_USER_DELETED = (
+    "🗑 <b>Админ удалил пользователя</b>\n"
+    "• <b>Админ:</b> <code>{admin}</code>\n"
+    "• <b>Пользователь:</b> <code>{user}</code>\n"
+    "• <b>Время (UTC):</b> <code>{now}</code>"
+)
+_LOG_SUB_EXTENDED = (
+    "🛠 <b>Админ продлил подписку</b>\n"
+    "• <b>Админ:</b> <code>{admin}</code>\n"
+    "• <b>Пользователь:</b> <code>{user}</code>\n"
+    "• <b>Добавлено дней:</b> <b>{days}</b>\n"
+    "• <b>Действует до:</b> <b>{expire}</b>\n"
+    "• <b>Время (UTC):</b> <code>{now}</code>"
+)
+_LOG_SUB_FOREVER = (
+    "♾ <b>Админ выдал бессрочную подписку</b>\n"
+    "• <b>Админ:</b> <code>{admin}</code>\n"
+    "• <b>Пользователь:</b> <code>{user}</code>\n"
+    "• <b>Время (UTC):</b> <code>{now}</code>"
+)
+_LOG_SUB_DISABLED = (
+    "⛔ <b>Админ отключил подписку</b>\n"
+    "• <b>Админ:</b> <code>{admin}</code>\n"
+    "• <b>Пользователь:</b> <code>{user}</code>\n"
+    "• <b>Время (UTC):</b> <code>{now}</code>"
+)
+_LOG_PRICE_CHANGED = (
+    "💸 <b>Админ изменил цену</b>\n"
+    "• <b>Админ:</b> <code>{admin}</code>\n"
+    "• <b>Поле:</b> <b>{label}</b>\n"
+    "• <b>Новое значение:</b> <code>{value}</code>\n"
+    "• <b>Время (UTC):</b> <code>{now}</code>"
+)
+
+# Caps in-flight broadcast setup replies (keyboard render + preview copy) across all admins.
+_BROADCAST_SEM = asyncio.Semaphore(10)
+
+_background_tasks: Set["asyncio.Task[Any]"] = set()
+
+
+def _spawn_background(coro: Any) -> "asyncio.Task[Any]":
+    # Keep a strong reference so fire-and-forget tasks are not garbage collected mid-flight.
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _parse_int(text: str) -> Optional[int]:
+    # Validate up front so mistyped admin input doesn't pay for a raised ValueError.
+    value = text.strip()
+    digits = value[1:] if value[:1] == "-" else value
+    return int(value) if digits.isdecimal() else None
+
+
+def _new_promo_code() -> str:
+    return "PROMO-" + "".join(secrets.choice(_PROMO_ALPHABET) for _ in range(6))
+
 
 def parse_callback_data(data: str) -> Dict[str, str]:
     result: Dict[str, str] = {}
@@ -153,6 +229,14 @@ def parse_callback_data(data: str) -> Dict[str, str]:
     return result
 
 
+def _italicize_lines(lines: List[str]) -> str:
+    if not lines:
+        return ""
+    if "" not in lines:
+        return "<i>" + "</i>\n<i>".join(lines) + "</i>"
+    return "\n".join([f"<i>{line}</i>" if line else "" for line in lines])
+
+
 def build_connect_text(customer: Customer, lang: str, tm: TranslationManager, traffic_text: str) -> str:
     now = datetime.utcnow()
     info_parts = []
@@ -244,13 +328,24 @@ def setup_router(
     pending_captcha: Dict[int, Dict[str, Any]] = {}
     pending_start_promo: Dict[int, str] = {}
     pending_settings_email: Set[int] = set()
-
+    # Serializes panel text steps per admin so fast consecutive messages don't race on panel_state.
+    panel_locks: Dict[int, asyncio.Lock] = {}
     def _button_emoji_id(lang: str, key: str) -> Optional[str]:
         value = tm.get_text(lang, f"{key}_emoji_id")
         if not value or value == f"{key}_emoji_id":
             return None
         return value
 
+    @lru_cache(maxsize=2048)
+    def _back_button(lang: str, callback_data: str) -> InlineKeyboardButton:
+        # aiogram types are immutable, so one button instance can be shared across markups.
+        return InlineKeyboardButton(
+            text=tm.get_text(lang, "back_button"),
+            callback_data=callback_data,
+            style="primary",
+            icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
+        )
+
     def _timezone() -> ZoneInfo:
         try:
             return ZoneInfo(config.stats_timezone)
@@ -279,8 +374,12 @@ def setup_router(
             except Exception as err:  # noqa: BLE001
                 logger.warning("failed to send log to chat=%s: %s", chat_id, err)
 
+    def _log_in_background(text: str) -> None:
+        # The admin already has their confirmation; don't hold the handler on the log chats.
+        _spawn_background(_send_log_message(text))
+
     def _is_admin(user_id: int) -> bool:
-        return user_id in config.notify_telegram_ids or (config.admin_telegram_id > 0 and user_id == config.admin_telegram_id)
+        return user_id == _ADMIN_ID or user_id in _NOTIFY_IDS
 
     def _admin_main_keyboard(lang: str) -> InlineKeyboardMarkup:
         return InlineKeyboardMarkup(
@@ -302,7 +401,7 @@ def setup_router(
                     InlineKeyboardButton(text=tm.get_text(lang, "promo_admin_create"), callback_data=CallbackPromoAdminCreate),
                     InlineKeyboardButton(text=tm.get_text(lang, "promo_admin_list"), callback_data=CallbackPromoAdminList),
                 ],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackStart)],
             ]
         )
 
@@ -313,7 +412,7 @@ def setup_router(
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_users_new_button"), callback_data=CallbackAdminUsersNew)],
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_users_find_button"), callback_data=CallbackAdminUsersFind)],
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_users_delete_button"), callback_data=CallbackAdminUsersDelete)],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackAdminPanel)],
             ]
         )
 
@@ -323,7 +422,7 @@ def setup_router(
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_sub_extend_button"), callback_data=CallbackAdminSubsExtend)],
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_sub_forever_button"), callback_data=CallbackAdminSubsForever)],
                 [InlineKeyboardButton(text=tm.get_text(lang, "admin_sub_disable_button"), callback_data=CallbackAdminSubsDisable)],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackAdminPanel)],
             ]
         )
 
@@ -438,12 +537,7 @@ def setup_router(
                 ],
                 [
                     InlineKeyboardButton(text=tm.get_text(lang, "admin_broadcast_cancel_button"), callback_data=CallbackAdminBroadcastCancel),
-                    InlineKeyboardButton(
-                        text=tm.get_text(lang, "back_button"),
-                        callback_data=CallbackAdminPanel,
-                        style="primary",
-                        icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                    ),
+                    _back_button(lang, CallbackAdminPanel),
                 ],
             ]
         )
@@ -468,7 +562,7 @@ def setup_router(
                         callback_data=CallbackAdminBroadcastButtonStyle,
                     )
                 ],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminBroadcast, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackAdminBroadcast)],
             ]
         )
 
@@ -480,11 +574,7 @@ def setup_router(
                     InlineKeyboardButton(text="English", callback_data=f"{CallbackLanguage}?v=en&b={back_callback}"),
                 ],
                 [
-                    InlineKeyboardButton(
-                        text=tm.get_text(lang, "back_button"),
-                        callback_data=back_callback,
-                        style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                    )
+                    _back_button(lang, back_callback)
                 ],
             ]
         )
@@ -524,7 +614,7 @@ def setup_router(
                         icon_custom_emoji_id=_button_emoji_id(lang, broadcast_emoji_key),
                     )
                 ],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackStart)],
             ]
         )
 
@@ -532,12 +622,7 @@ def setup_router(
         return InlineKeyboardMarkup(
             inline_keyboard=[
                 [
-                    InlineKeyboardButton(
-                        text=tm.get_text(lang, "back_button"),
-                        callback_data=CallbackSettings,
-                        style="primary",
-                        icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                    )
+                    _back_button(lang, CallbackSettings)
                 ]
             ]
         )
@@ -560,7 +645,7 @@ def setup_router(
         for key in PRICE_FIELD_ORDER:
             label = PRICE_FIELD_LABELS.get(key, key)
             rows.append([InlineKeyboardButton(text=label, callback_data=f"{CallbackAdminPriceEdit}?key={key}")])
-        rows.append([InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))])
+        rows.append([_back_button(lang, CallbackAdminPanel)])
         return InlineKeyboardMarkup(inline_keyboard=rows)
 
     def _pricing_text(lang: str) -> str:
@@ -761,12 +846,7 @@ def setup_router(
         rows.append([InlineKeyboardButton(text=tm.get_text(lang, "my_devices_refresh_button"), callback_data=CallbackConnectDevices)])
         rows.append(
             [
-                InlineKeyboardButton(
-                    text=tm.get_text(lang, "back_button"),
-                    callback_data=CallbackConnect,
-                    style="primary",
-                    icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                )
+                _back_button(lang, CallbackConnect)
             ]
         )
         return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -781,12 +861,7 @@ def setup_router(
                     )
                 ],
                 [
-                    InlineKeyboardButton(
-                        text=tm.get_text(lang, "back_button"),
-                        callback_data=CallbackConnectDevices,
-                        style="primary",
-                        icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                    )
+                    _back_button(lang, CallbackConnectDevices)
                 ],
             ]
         )
@@ -816,7 +891,7 @@ def setup_router(
                 current_row = []
         if current_row:
             rows.append(current_row)
-        rows.append([InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackBuy, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))])
+        rows.append([_back_button(lang, CallbackBuy)])
         return InlineKeyboardMarkup(inline_keyboard=rows)
 
     def _agift_duration_keyboard(lang: str) -> InlineKeyboardMarkup:
@@ -832,7 +907,7 @@ def setup_router(
                     InlineKeyboardButton(text=tm.get_text(lang, "month_3"), callback_data=f"{CallbackAdminGiftDuration}?month=3"),
                     InlineKeyboardButton(text=tm.get_text(lang, "month_6"), callback_data=f"{CallbackAdminGiftDuration}?month=6"),
                 ],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackAdminPanel)],
             ]
         )
 
@@ -843,7 +918,7 @@ def setup_router(
                     InlineKeyboardButton(text=tm.get_text(lang, "agift_tag_sub_button"), callback_data=f"{CallbackAdminGiftTag}?tag=sub"),
                     InlineKeyboardButton(text=tm.get_text(lang, "agift_tag_gift_button"), callback_data=f"{CallbackAdminGiftTag}?tag=gift"),
                 ],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminGift, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackAdminGift)],
             ]
         )
 
@@ -939,7 +1014,7 @@ def setup_router(
                     )
                 ]
             )
-        buttons.append([InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackGiftMenu, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))])
+        buttons.append([_back_button(lang, CallbackGiftMenu)])
         return InlineKeyboardMarkup(inline_keyboard=buttons)
 
     async def _is_stars_allowed_for_customer(telegram_id: int) -> bool:
@@ -1014,8 +1089,7 @@ def setup_router(
         normalized = code.strip().upper()
         if not normalized or len(normalized) > 64:
             return None
-        allowed = set(string.ascii_uppercase + string.digits + "-_")
-        if any(ch not in allowed for ch in normalized):
+        if any(ch not in _PROMO_CODE_CHARS for ch in normalized):
             return None
         return normalized
 
@@ -1120,18 +1194,19 @@ def setup_router(
         await _send_log_message(text)
 
     def _is_valid_broadcast_button_url(url: str) -> bool:
-        lowered = (url or "").strip().lower()
-        return lowered.startswith("https://") or lowered.startswith("http://") or lowered.startswith("tg://")
+        return _BUTTON_URL_RE.match((url or "").strip()) is not None
 
-    async def _resolve_broadcast_target_ids(audience: str) -> List[int]:
+    async def _iter_broadcast_target_ids(audience: str) -> AsyncIterator[List[int]]:
         now_utc = datetime.utcnow()
         if audience == "all":
-            return await customer_repo.list_all_telegram_ids()
-        if audience == "active":
-            return await customer_repo.list_active_telegram_ids(now_utc)
-        if audience == "inactive":
-            return await customer_repo.list_inactive_telegram_ids(now_utc)
-        return await customer_repo.list_broadcast_enabled_telegram_ids()
+            yield await customer_repo.list_all_telegram_ids()
+        elif audience == "active":
+            yield await customer_repo.list_active_telegram_ids(now_utc)
+        elif audience == "inactive":
+            yield await customer_repo.list_inactive_telegram_ids(now_utc)
+        else:
+            async for batch in customer_repo.iter_broadcast_enabled_telegram_ids():
+                yield batch
 
     async def _copy_broadcast_message(target_chat_id: int, state: Dict[str, Any]) -> None:
         source_chat_id = state.get("broadcast_source_chat_id")
@@ -1150,20 +1225,21 @@ def setup_router(
         state["broadcast_source_chat_id"] = message.chat.id
         state["broadcast_source_message_id"] = message.message_id
         state["step"] = "broadcast_idle"
-        await message.answer(
-            tm.get_text(lang, "admin_broadcast_message_saved"),
-            reply_markup=_admin_broadcast_keyboard(lang, state),
-            parse_mode="HTML",
-        )
-        try:
-            await _copy_broadcast_message(message.from_user.id, state)
-        except Exception as err:  # noqa: BLE001
-            logger.warning("broadcast preview copy failed: %s", err)
-            await message.answer(tm.get_text(lang, "admin_broadcast_preview_failed"), parse_mode="HTML")
+        async with _BROADCAST_SEM:
+            await message.answer(
+                tm.get_text(lang, "admin_broadcast_message_saved"),
+                reply_markup=_admin_broadcast_keyboard(lang, state),
+                parse_mode="HTML",
+            )
+            try:
+                await _copy_broadcast_message(message.from_user.id, state)
+            except Exception as err:  # noqa: BLE001
+                logger.warning("broadcast preview copy failed: %s", err)
+                await message.answer(tm.get_text(lang, "admin_broadcast_preview_failed"), parse_mode="HTML")
 
     async def _show_start_home(message: Message, customer: Customer, lang: str) -> None:
         customer = await payment_service.refresh_customer_subscription(customer)
-        markup = start_keyboard(customer, lang, tm)
+        markup = start_markup(customer, lang, tm)
         temp_msg = await message.answer("...", reply_markup=ReplyKeyboardRemove(remove_keyboard=True))
         try:
             await message.bot.delete_message(chat_id=message.chat.id, message_id=temp_msg.message_id)
@@ -1171,7 +1247,7 @@ def setup_router(
             pass
         await message.answer(
             tm.get_text(lang, "greeting"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=markup),
+            reply_markup=markup,
             parse_mode="HTML",
         )
         await _deliver_pending_gift_notifications(customer.telegram_id)
@@ -1293,10 +1369,10 @@ def setup_router(
 
         await _apply_pending_start_promo(customer, lang, callback.from_user.username)
         customer = await payment_service.refresh_customer_subscription(customer)
-        markup = start_keyboard(customer, lang, tm)
+        markup = start_markup(customer, lang, tm)
         await callback.message.edit_text(
             tm.get_text(lang, "greeting"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=markup),
+            reply_markup=markup,
             parse_mode="HTML",
         )
         await _deliver_pending_gift_notifications(customer.telegram_id)
@@ -1317,10 +1393,10 @@ def setup_router(
             await callback.answer()
             return
         customer = await payment_service.refresh_customer_subscription(customer)
-        markup = start_keyboard(customer, lang, tm)
+        markup = start_markup(customer, lang, tm)
         await callback.message.edit_text(
             tm.get_text(lang, "greeting"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=markup),
+            reply_markup=markup,
             parse_mode="HTML",
         )
         await _deliver_pending_gift_notifications(customer.telegram_id)
@@ -1353,10 +1429,10 @@ def setup_router(
         else:
             await _apply_pending_start_promo(customer, lang, callback.from_user.username)
             customer = await payment_service.refresh_customer_subscription(customer)
-            markup = start_keyboard(customer, lang, tm)
+            markup = start_markup(customer, lang, tm)
             await callback.message.edit_text(
                 tm.get_text(lang, "greeting"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=markup),
+                reply_markup=markup,
                 parse_mode="HTML",
             )
             await _deliver_pending_gift_notifications(customer.telegram_id)
@@ -1581,7 +1657,7 @@ def setup_router(
                     InlineKeyboardButton(text=tm.get_text(lang, "promo_admin_list"), callback_data=CallbackPromoAdminList),
                 ],
                 [
-                    InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button")),
+                    _back_button(lang, CallbackAdminPanel),
                 ],
             ]
         )
@@ -1597,7 +1673,7 @@ def setup_router(
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text=tm.get_text(lang, "stats_refresh_button"), callback_data=CallbackStats)],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackStart)],
             ]
         )
         await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
@@ -1891,6 +1967,7 @@ def setup_router(
         lang = callback.from_user.language_code or config.default_language
         state = _ensure_broadcast_state(callback.from_user.id)
         state["step"] = "await_broadcast_button_text"
+        state["panel_message_id"] = callback.message.message_id
         await callback.message.edit_text(
             tm.get_text(lang, "admin_broadcast_button_text_prompt"),
             reply_markup=_admin_broadcast_button_keyboard(lang, state),
@@ -1906,6 +1983,7 @@ def setup_router(
         lang = callback.from_user.language_code or config.default_language
         state = _ensure_broadcast_state(callback.from_user.id)
         state["step"] = "await_broadcast_button_url"
+        state["panel_message_id"] = callback.message.message_id
         await callback.message.edit_text(
             tm.get_text(lang, "admin_broadcast_button_url_prompt"),
             reply_markup=_admin_broadcast_button_keyboard(lang, state),
@@ -1921,6 +1999,7 @@ def setup_router(
         lang = callback.from_user.language_code or config.default_language
         state = _ensure_broadcast_state(callback.from_user.id)
         state["step"] = "await_broadcast_button_emoji"
+        state["panel_message_id"] = callback.message.message_id
         await callback.message.edit_text(
             tm.get_text(lang, "admin_broadcast_button_emoji_prompt"),
             reply_markup=_admin_broadcast_button_keyboard(lang, state),
@@ -1979,19 +2058,19 @@ def setup_router(
             await callback.answer(tm.get_text(lang, "admin_broadcast_button_incomplete"), show_alert=True)
             return
         audience = state.get("broadcast_audience", "broadcast_enabled")
-        user_ids = await _resolve_broadcast_target_ids(audience)
         success = 0
         failed = 0
-        for user_id in user_ids:
-            if user_id in config.blocked_telegram_ids:
-                continue
-            try:
-                await _copy_broadcast_message(user_id, state)
-                success += 1
-            except Exception as err:  # noqa: BLE001
-                logger.debug("broadcast send failed user=%s: %s", user_id, err)
-                failed += 1
-            await asyncio.sleep(0.04)
+        async for user_ids in _iter_broadcast_target_ids(audience):
+            for user_id in user_ids:
+                if user_id in config.blocked_telegram_ids:
+                    continue
+                try:
+                    await _copy_broadcast_message(user_id, state)
+                    success += 1
+                except Exception as err:  # noqa: BLE001
+                    logger.debug("broadcast send failed user=%s: %s", user_id, err)
+                    failed += 1
+                await asyncio.sleep(0.04)
         state["step"] = "broadcast_idle"
         result_text = (
             tm.get_text(lang, "admin_broadcast_done") % (success, failed)
@@ -2233,13 +2312,13 @@ def setup_router(
                     )
                 ]
             )
-        buttons.append([InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))])
+        buttons.append([_back_button(lang, CallbackStart)])
         return InlineKeyboardMarkup(inline_keyboard=buttons)
 
     def _connect_instructions_markup(lang: str) -> InlineKeyboardMarkup:
         return InlineKeyboardMarkup(
             inline_keyboard=[
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackConnect, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))]
+                [_back_button(lang, CallbackConnect)]
             ]
         )
 
@@ -2430,20 +2509,17 @@ def setup_router(
         if plan == "duo" and duo_member_ids:
             await duo_member_repo.replace_members(purchase_id, duo_member_ids)
 
-        back_callback = f"{CallbackSell}?month={month}&amount={price}"
         if is_gift:
             back_callback = CallbackGiftMenu
         elif plan == "duo":
-            back_callback = f"{CallbackDuoMembers}?month={month}"
+            back_callback = _BACK_DUO_FMT % month
+        else:
+            back_callback = _BACK_SELL_FMT % (month, price)
         markup = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
                     InlineKeyboardButton(text=tm.get_text(lang, "pay_button"), url=url, style="success"),
-                    InlineKeyboardButton(
-                        text=tm.get_text(lang, "back_button"),
-                        callback_data=back_callback,
-                        style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"),
-                    ),
+                    _back_button(lang, back_callback),
                 ]
             ]
         )
@@ -2460,14 +2536,12 @@ def setup_router(
 
     @router.message(F.successful_payment)
     async def successful_payment_handler(message: Message) -> None:
-        payload = (message.successful_payment.invoice_payload or "").split("&")
-        if not payload:
-            return
+        head, _, tail = (message.successful_payment.invoice_payload or "").partition("&")
         try:
-            purchase_id = int(payload[0])
+            purchase_id = int(head)
         except ValueError:
             return
-        username = payload[1] if len(payload) > 1 else None
+        username = tail.partition("&")[0] or None
         await payment_service.process_purchase_by_id(purchase_id, username=username)
 
     @router.message(F.users_shared | F.user_shared)
@@ -2548,7 +2622,7 @@ def setup_router(
                 allow_stars=allow_stars,
                 allow_platega=config.platega_enabled and config.platega_merchant_id and config.platega_secret,
                 tribute_url=config.tribute_payment_url if config.tribute_webhook_url else None,
-                back_callback=f"{CallbackDuoMembers}?month={month}",
+                back_callback=_BACK_DUO_FMT % month,
                 duo_member_ids=member_ids[:1],
             )
             await message.answer(
@@ -2643,7 +2717,7 @@ def setup_router(
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[
                     [InlineKeyboardButton(text=tm.get_text(lang, "activate_trial_button"), callback_data=CallbackActivateTrial, icon_custom_emoji_id=_button_emoji_id(lang, "activate_trial_button"))],
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackStart)],
                 ]
             ),
             parse_mode="HTML",
@@ -2675,7 +2749,7 @@ def setup_router(
         markup = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text=tm.get_text(lang, "connect_button"), callback_data=CallbackConnect, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "connect_button"))],
-                [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                [_back_button(lang, CallbackStart)],
             ]
         )
         await callback.message.edit_text(
@@ -2705,7 +2779,7 @@ def setup_router(
         lines.append(tm.get_text(lang, "referral_link_text") % ref_url)
         share_text = tm.get_text(lang, "referral_share_text")
         ref_link = f"https://t.me/share/url?url={quote_plus(ref_url)}&text={quote_plus(share_text)}"
-        text = "\n".join(f"<i>{line}</i>" if line else "" for line in lines)
+        text = _italicize_lines(lines)
         await callback.message.edit_text(
             text,
             reply_markup=InlineKeyboardMarkup(
@@ -2724,7 +2798,7 @@ def setup_router(
                             icon_custom_emoji_id=_button_emoji_id(lang, "referral_list_button"),
                         )
                     ],
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackStart)],
                 ]
             ),
             parse_mode="HTML",
@@ -2794,11 +2868,11 @@ def setup_router(
                 lines.append(tm.get_text(lang, "referral_list_more") % (len(details) - 30))
         else:
             lines.append(tm.get_text(lang, "referral_empty"))
-        text = "\n".join(f"<i>{line}</i>" if line else "" for line in lines)
+        text = _italicize_lines(lines)
         await callback.message.edit_text(
             text,
             reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackReferral, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))]]
+                inline_keyboard=[[_back_button(lang, CallbackReferral)]]
             ),
             parse_mode="HTML",
         )
@@ -2811,7 +2885,7 @@ def setup_router(
         await callback.message.answer(
             tm.get_text(lang, "promo_enter_prompt"),
             reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackBuy, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))]]
+                inline_keyboard=[[_back_button(lang, CallbackBuy)]]
             ),
             parse_mode="HTML",
         )
@@ -2830,7 +2904,7 @@ def setup_router(
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[
                     [InlineKeyboardButton(text=tm.get_text(lang, "stats_refresh_button"), callback_data=CallbackStats)],
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackStart, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackStart)],
                 ]
             ),
             parse_mode="HTML",
@@ -2858,7 +2932,7 @@ def setup_router(
             text,
             reply_markup=InlineKeyboardMarkup(
                 inline_keyboard=[
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackPromoAdmin, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackPromoAdmin)],
                 ]
             ),
             parse_mode="HTML",
@@ -2882,7 +2956,7 @@ def setup_router(
                         InlineKeyboardButton(text=tm.get_text(lang, "promo_type_days"), callback_data=CallbackPromoTypeDays),
                         InlineKeyboardButton(text=tm.get_text(lang, "promo_type_gb"), callback_data=CallbackPromoTypeGb),
                     ],
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackPromoAdmin, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackPromoAdmin)],
                 ]
             ),
             parse_mode="HTML",
@@ -2927,13 +3001,291 @@ def setup_router(
                         InlineKeyboardButton(text=tm.get_text(lang, "promo_admin_create"), callback_data=CallbackPromoAdminCreate),
                         InlineKeyboardButton(text=tm.get_text(lang, "promo_admin_list"), callback_data=CallbackPromoAdminList),
                     ],
-                    [InlineKeyboardButton(text=tm.get_text(lang, "back_button"), callback_data=CallbackAdminPanel, style="primary", icon_custom_emoji_id=_button_emoji_id(lang, "back_button"))],
+                    [_back_button(lang, CallbackAdminPanel)],
                 ]
             ),
             parse_mode="HTML",
         )
         await callback.answer()
 
+    async def _handle_await_user_lookup(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        telegram_id = _parse_int(text_val)
+        if telegram_id is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
+            return
+        customer = await customer_repo.find_by_telegram_id(telegram_id)
+        if not customer:
+            await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
+            panel_state.pop(uid, None)
+            return
+        customer = await payment_service.refresh_customer_subscription(customer)
+        used, limit, ok = await sync_service.get_traffic_usage(customer.telegram_id)
+        if ok and limit > 0:
+            used_gb = round(used / 1_073_741_824, 2)
+            limit_gb = round(limit / 1_073_741_824, 2)
+            traffic_text = f"{used_gb}/{limit_gb} GB"
+        else:
+            traffic_text = "-"
+        expire = customer.expire_at.strftime("%d.%m.%Y %H:%M") if customer.expire_at else "-"
+        active = "yes" if customer.expire_at and customer.expire_at > datetime.utcnow() else "no"
+        username = f"@{customer.username}" if customer.username else "-"
+        await message.answer(
+            tm.get_text(lang, "admin_user_info_template") % (
+                customer.telegram_id,
+                username,
+                customer.created_at.strftime("%d.%m.%Y %H:%M"),
+                expire,
+                active,
+                traffic_text,
+            ),
+            parse_mode="HTML",
+        )
+        panel_state.pop(uid, None)
+
+    async def _handle_await_user_delete(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        telegram_id = _parse_int(text_val)
+        if telegram_id is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
+            return
+        customer = await customer_repo.find_by_telegram_id(telegram_id)
+        if not customer:
+            await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
+            panel_state.pop(uid, None)
+            return
+        try:
+            removed_from_remnawave = await payment_service.remnawave_client.delete_user_by_telegram(telegram_id)
+        except Exception as err:  # noqa: BLE001
+            logger.warning("failed to delete user from remnawave telegram_id=%s: %s", telegram_id, err)
+            await message.answer(tm.get_text(lang, "admin_user_delete_remnawave_failed"), parse_mode="HTML")
+            return
+        if not removed_from_remnawave:
+            await message.answer(tm.get_text(lang, "admin_user_delete_remnawave_failed"), parse_mode="HTML")
+            return
+        deleted_from_db = await customer_repo.delete_by_telegram_id(telegram_id)
+        if not deleted_from_db:
+            await message.answer(tm.get_text(lang, "admin_user_delete_db_failed"), parse_mode="HTML")
+            return
+        panel_state.pop(uid, None)
+        await message.answer(tm.get_text(lang, "admin_user_deleted_done") % telegram_id, parse_mode="HTML")
+        _log_in_background(_LOG_USER_DELETED.format(admin=uid, user=telegram_id, now=_utc_now_text()))
+
+    async def _handle_await_sub_extend(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        parts = text_val.split()
+        if len(parts) != 2:
+            await message.answer(tm.get_text(lang, "admin_sub_extend_format"), parse_mode="HTML")
+            return
+        telegram_id = _parse_int(parts[0])
+        days = _parse_int(parts[1])
+        if telegram_id is None or days is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
+            return
+        customer, current_user = await asyncio.gather(
+            customer_repo.find_by_telegram_id(telegram_id),
+            payment_service.remnawave_client.fetch_user_by_telegram(telegram_id),
+        )
+        if not customer:
+            await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
+            panel_state.pop(uid, None)
+            return
+        traffic_limit = (
+            int(current_user.traffic_limit_bytes)
+            if current_user and current_user.traffic_limit_bytes
+            else config.traffic_limit_bytes
+        )
+        updated_user = await payment_service.remnawave_client.create_or_update_user(
+            customer_id=customer.id,
+            telegram_id=telegram_id,
+            traffic_limit_bytes=traffic_limit,
+            days=days,
+            is_trial_user=False,
+            username=customer.username,
+        )
+        await customer_repo.update_fields(
+            customer.id,
+            {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
+        )
+        panel_state.pop(uid, None)
+        expire_str = updated_user.expire_at.strftime("%d.%m.%Y %H:%M")
+        await message.answer(
+            tm.get_text(lang, "admin_sub_updated") % (telegram_id, expire_str),
+            parse_mode="HTML",
+        )
+        _log_in_background(
+            _LOG_SUB_EXTENDED.format(
+                admin=uid,
+                user=telegram_id,
+                days=days,
+                expire=expire_str,
+                now=_utc_now_text(),
+            )
+        )
+
+    async def _handle_await_sub_forever(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        telegram_id = _parse_int(text_val)
+        if telegram_id is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
+            return
+        customer = await customer_repo.find_by_telegram_id(telegram_id)
+        if not customer:
+            await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
+            panel_state.pop(uid, None)
+            return
+        updated_user = await payment_service.remnawave_client.set_user_expire_at(
+            telegram_id=telegram_id,
+            expire_at=FOREVER_EXPIRE_AT,
+        )
+        if updated_user:
+            await customer_repo.update_fields(
+                customer.id,
+                {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
+            )
+        panel_state.pop(uid, None)
+        await message.answer(
+            tm.get_text(lang, "admin_sub_forever_done") % telegram_id,
+            parse_mode="HTML",
+        )
+        _log_in_background(_LOG_SUB_FOREVER.format(admin=uid, user=telegram_id, now=_utc_now_text()))
+
+    async def _handle_await_sub_disable(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        telegram_id = _parse_int(text_val)
+        if telegram_id is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
+            return
+        customer = await customer_repo.find_by_telegram_id(telegram_id)
+        if not customer:
+            await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
+            panel_state.pop(uid, None)
+            return
+        disabled_dt = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=1)
+        updated_user = await payment_service.remnawave_client.set_user_expire_at(
+            telegram_id=telegram_id,
+            expire_at=disabled_dt,
+        )
+        if updated_user:
+            await customer_repo.update_fields(
+                customer.id,
+                {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
+            )
+        else:
+            await customer_repo.update_fields(customer.id, {"expire_at": disabled_dt.isoformat()})
+        panel_state.pop(uid, None)
+        await message.answer(
+            tm.get_text(lang, "admin_sub_disabled_done") % telegram_id,
+            parse_mode="HTML",
+        )
+        _log_in_background(_LOG_SUB_DISABLED.format(admin=uid, user=telegram_id, now=_utc_now_text()))
+
+    async def _handle_await_broadcast_source(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        await _save_broadcast_source_message(message, lang)
+
+    async def _show_broadcast_button_settings(message: Message, lang: str, state: Dict[str, Any]) -> None:
+        text = _broadcast_button_settings_text(lang, state)
+        markup = _admin_broadcast_button_keyboard(lang, state)
+        panel_message_id = state.get("panel_message_id")
+        if panel_message_id:
+            try:
+                await message.bot.edit_message_text(
+                    chat_id=message.chat.id,
+                    message_id=panel_message_id,
+                    text=text,
+                    reply_markup=markup,
+                    parse_mode="HTML",
+                )
+                return
+            except Exception as err:  # noqa: BLE001
+                logger.warning("failed to edit broadcast panel message_id=%s: %s", panel_message_id, err)
+                state.pop("panel_message_id", None)
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    async def _handle_await_broadcast_button_text(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        state["button_text"] = text_val
+        state["step"] = "broadcast_idle"
+        async with _BROADCAST_SEM:
+            await _show_broadcast_button_settings(message, lang, state)
+
+    async def _handle_await_broadcast_button_url(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        if not _is_valid_broadcast_button_url(text_val):
+            await message.answer(tm.get_text(lang, "admin_broadcast_button_url_invalid"), parse_mode="HTML")
+            return
+        state["button_url"] = text_val
+        state["step"] = "broadcast_idle"
+        async with _BROADCAST_SEM:
+            await _show_broadcast_button_settings(message, lang, state)
+
+    async def _handle_await_broadcast_button_emoji(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        state["button_emoji_id"] = text_val
+        state["step"] = "broadcast_idle"
+        async with _BROADCAST_SEM:
+            await _show_broadcast_button_settings(message, lang, state)
+
+    async def _handle_await_price_value(message: Message, uid: int, state: Dict[str, Any], lang: str, text_val: str) -> None:
+        key = state.get("key")
+        if key not in PRICE_FIELD_ORDER:
+            panel_state.pop(uid, None)
+            return
+        value = _parse_int(text_val)
+        if value is None:
+            await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
+            return
+        if value < 0:
+            await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
+            return
+        await price_repo.set_value(key, value, uid)
+        setattr(config, key, value)
+        panel_state.pop(uid, None)
+        label = PRICE_FIELD_LABELS.get(key, key)
+        await message.answer(
+            tm.get_text(lang, "admin_price_updated") % (label, value),
+            parse_mode="HTML",
+        )
+        _log_in_background(
+            _LOG_PRICE_CHANGED.format(admin=uid, label=_PRICE_FIELD_LABELS_HTML.get(key, key), value=value, now=_utc_now_text())
+        )
+
+    panel_step_handlers: Dict[str, Callable[[Message, int, Dict[str, Any], str, str], Awaitable[None]]] = {
+        "await_user_lookup": _handle_await_user_lookup,
+        "await_user_delete": _handle_await_user_delete,
+        "await_sub_extend": _handle_await_sub_extend,
+        "await_sub_forever": _handle_await_sub_forever,
+        "await_sub_disable": _handle_await_sub_disable,
+        "await_broadcast_source": _handle_await_broadcast_source,
+        "await_broadcast_button_text": _handle_await_broadcast_button_text,
+        "await_broadcast_button_url": _handle_await_broadcast_button_url,
+        "await_broadcast_button_emoji": _handle_await_broadcast_button_emoji,
+        "await_price_value": _handle_await_price_value,
+    }
+
+    async def _handle_promo_days(message: Message, uid: int, state: Dict[str, Any], lang: str, value: int) -> None:
+        if value < 0:
+            await message.answer(tm.get_text(lang, "promo_invalid_number"), parse_mode="HTML")
+            return
+        promo_admin_state[uid] = {"step": "await_uses", "days": value, "gb": 0}
+        await message.answer(tm.get_text(lang, "promo_enter_uses"), parse_mode="HTML")
+
+    async def _handle_promo_gb(message: Message, uid: int, state: Dict[str, Any], lang: str, value: int) -> None:
+        if value < 0:
+            await message.answer(tm.get_text(lang, "promo_invalid_number"), parse_mode="HTML")
+            return
+        promo_admin_state[uid] = {"step": "await_uses", "days": 0, "gb": value}
+        await message.answer(tm.get_text(lang, "promo_enter_uses"), parse_mode="HTML")
+
+    async def _handle_promo_uses(message: Message, uid: int, state: Dict[str, Any], lang: str, value: int) -> None:
+        days = state.get("days", 0)
+        gb = state.get("gb", 0)
+        uses = max(1, value)
+        promo = await promo_repo.create_unique(_new_promo_code, days, gb, uses, uid)
+        promo_admin_state.pop(uid, None)
+        await message.answer(
+            tm.get_text(lang, "promo_admin_created") % (promo.code, promo.days, promo.traffic_gb, promo.max_uses),
+            parse_mode="HTML",
+        )
+
+    promo_step_handlers: Dict[str, Callable[[Message, int, Dict[str, Any], str, int], Awaitable[None]]] = {
+        "await_days": _handle_promo_days,
+        "await_gb": _handle_promo_gb,
+        "await_uses": _handle_promo_uses,
+    }
+
     @router.message(~F.text)
     async def admin_broadcast_media_handler(message: Message) -> None:
         if not _is_admin(message.from_user.id):
@@ -2946,13 +3298,14 @@ def setup_router(
 
     @router.message(F.text)
     async def promo_text_handler(message: Message) -> None:
+        uid = message.from_user.id
         lang = message.from_user.language_code or config.default_language
         text_val = message.text.strip()
 
-        if message.from_user.id in pending_settings_email:
-            customer = await customer_repo.find_by_telegram_id(message.from_user.id)
+        if uid in pending_settings_email:
+            customer = await customer_repo.find_by_telegram_id(uid)
             if not customer:
-                pending_settings_email.discard(message.from_user.id)
+                pending_settings_email.discard(uid)
                 return
             lang = customer.language or message.from_user.language_code or config.default_language
             clear_requested = text_val == "-"
@@ -2972,7 +3325,7 @@ def setup_router(
             if not updated:
                 await message.answer(tm.get_text(lang, "settings_email_not_found"), parse_mode="HTML")
                 return
-            pending_settings_email.discard(message.from_user.id)
+            pending_settings_email.discard(uid)
             if clear_requested:
                 await message.answer(tm.get_text(lang, "settings_email_cleared"), parse_mode="HTML")
             else:
@@ -2988,323 +3341,40 @@ def setup_router(
             return
 
         # Admin panel actions via text input after inline selection.
-        if (
-            _is_admin(message.from_user.id)
-            and message.from_user.id in panel_state
-            and message.from_user.id not in promo_admin_state
-        ):
-            state = panel_state[message.from_user.id]
-            step = state.get("step")
-
-            if step == "await_user_lookup":
-                try:
-                    telegram_id = int(text_val)
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
-                    return
-                customer = await customer_repo.find_by_telegram_id(telegram_id)
-                if not customer:
-                    await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
-                    panel_state.pop(message.from_user.id, None)
+        is_admin = _is_admin(uid)
+        if is_admin and uid in panel_state and uid not in promo_admin_state:
+            async with panel_locks.setdefault(uid, asyncio.Lock()):
+                # Re-read under the lock: the previous message may have moved the step on.
+                state = panel_state.get(uid)
+                handler = panel_step_handlers.get(state.get("step")) if state else None
+                if handler:
+                    await handler(message, uid, state, lang, text_val)
                     return
-                customer = await payment_service.refresh_customer_subscription(customer)
-                used, limit, ok = await sync_service.get_traffic_usage(customer.telegram_id)
-                if ok and limit > 0:
-                    used_gb = round(used / 1_073_741_824, 2)
-                    limit_gb = round(limit / 1_073_741_824, 2)
-                    traffic_text = f"{used_gb}/{limit_gb} GB"
-                else:
-                    traffic_text = "-"
-                expire = customer.expire_at.strftime("%d.%m.%Y %H:%M") if customer.expire_at else "-"
-                active = "yes" if customer.expire_at and customer.expire_at > datetime.utcnow() else "no"
-                username = f"@{customer.username}" if customer.username else "-"
-                await message.answer(
-                    tm.get_text(lang, "admin_user_info_template") % (
-                        customer.telegram_id,
-                        username,
-                        customer.created_at.strftime("%d.%m.%Y %H:%M"),
-                        expire,
-                        active,
-                        traffic_text,
-                    ),
-                    parse_mode="HTML",
-                )
-                panel_state.pop(message.from_user.id, None)
-                return
-
-            if step == "await_user_delete":
-                try:
-                    telegram_id = int(text_val)
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
-                    return
-                customer = await customer_repo.find_by_telegram_id(telegram_id)
-                if not customer:
-                    await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
-                    panel_state.pop(message.from_user.id, None)
-                    return
-                try:
-                    removed_from_remnawave = await payment_service.remnawave_client.delete_user_by_telegram(telegram_id)
-                except Exception as err:  # noqa: BLE001
-                    logger.warning("failed to delete user from remnawave telegram_id=%s: %s", telegram_id, err)
-                    await message.answer(tm.get_text(lang, "admin_user_delete_remnawave_failed"), parse_mode="HTML")
-                    return
-                if not removed_from_remnawave:
-                    await message.answer(tm.get_text(lang, "admin_user_delete_remnawave_failed"), parse_mode="HTML")
-                    return
-                deleted_from_db = await customer_repo.delete_by_telegram_id(telegram_id)
-                if not deleted_from_db:
-                    await message.answer(tm.get_text(lang, "admin_user_delete_db_failed"), parse_mode="HTML")
-                    return
-                panel_state.pop(message.from_user.id, None)
-                await message.answer(tm.get_text(lang, "admin_user_deleted_done") % telegram_id, parse_mode="HTML")
-                await _send_log_message(
-                    "🗑 <b>Админ удалил пользователя</b>\n"
-                    f"• <b>Админ:</b> <code>{message.from_user.id}</code>\n"
-                    f"• <b>Пользователь:</b> <code>{telegram_id}</code>\n"
-                    f"• <b>Время (UTC):</b> <code>{_utc_now_text()}</code>"
-                )
-                return
-
-            if step == "await_sub_extend":
-                parts = text_val.split()
-                if len(parts) != 2:
-                    await message.answer(tm.get_text(lang, "admin_sub_extend_format"), parse_mode="HTML")
-                    return
-                try:
-                    telegram_id = int(parts[0])
-                    days = int(parts[1])
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
-                    return
-                customer = await customer_repo.find_by_telegram_id(telegram_id)
-                if not customer:
-                    await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
-                    panel_state.pop(message.from_user.id, None)
-                    return
-                current_user = await payment_service.remnawave_client.fetch_user_by_telegram(telegram_id)
-                traffic_limit = (
-                    int(current_user.traffic_limit_bytes)
-                    if current_user and current_user.traffic_limit_bytes
-                    else config.traffic_limit_bytes
-                )
-                updated_user = await payment_service.remnawave_client.create_or_update_user(
-                    customer_id=customer.id,
-                    telegram_id=telegram_id,
-                    traffic_limit_bytes=traffic_limit,
-                    days=days,
-                    is_trial_user=False,
-                    username=customer.username,
-                )
-                await customer_repo.update_fields(
-                    customer.id,
-                    {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
-                )
-                panel_state.pop(message.from_user.id, None)
-                await message.answer(
-                    tm.get_text(lang, "admin_sub_updated") % (telegram_id, updated_user.expire_at.strftime("%d.%m.%Y %H:%M")),
-                    parse_mode="HTML",
-                )
-                await _send_log_message(
-                    "🛠 <b>Админ продлил подписку</b>\n"
-                    f"• <b>Админ:</b> <code>{message.from_user.id}</code>\n"
-                    f"• <b>Пользователь:</b> <code>{telegram_id}</code>\n"
-                    f"• <b>Добавлено дней:</b> <b>{days}</b>\n"
-                    f"• <b>Действует до:</b> <b>{updated_user.expire_at.strftime('%d.%m.%Y %H:%M')}</b>\n"
-                    f"• <b>Время (UTC):</b> <code>{_utc_now_text()}</code>"
-                )
-                return
-
-            if step == "await_sub_forever":
-                try:
-                    telegram_id = int(text_val)
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
-                    return
-                customer = await customer_repo.find_by_telegram_id(telegram_id)
-                if not customer:
-                    await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
-                    panel_state.pop(message.from_user.id, None)
-                    return
-                forever_dt = datetime(2099, 12, 31, 23, 59, 59)
-                updated_user = await payment_service.remnawave_client.set_user_expire_at(
-                    telegram_id=telegram_id,
-                    expire_at=forever_dt,
-                )
-                if updated_user:
-                    await customer_repo.update_fields(
-                        customer.id,
-                        {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
-                    )
-                panel_state.pop(message.from_user.id, None)
-                await message.answer(
-                    tm.get_text(lang, "admin_sub_forever_done") % telegram_id,
-                    parse_mode="HTML",
-                )
-                await _send_log_message(
-                    "♾ <b>Админ выдал бессрочную подписку</b>\n"
-                    f"• <b>Админ:</b> <code>{message.from_user.id}</code>\n"
-                    f"• <b>Пользователь:</b> <code>{telegram_id}</code>\n"
-                    f"• <b>Время (UTC):</b> <code>{_utc_now_text()}</code>"
-                )
-                return
-
-            if step == "await_sub_disable":
-                try:
-                    telegram_id = int(text_val)
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_id"), parse_mode="HTML")
-                    return
-                customer = await customer_repo.find_by_telegram_id(telegram_id)
-                if not customer:
-                    await message.answer(tm.get_text(lang, "admin_user_not_found"), parse_mode="HTML")
-                    panel_state.pop(message.from_user.id, None)
-                    return
-                disabled_dt = datetime.utcnow() - timedelta(minutes=1)
-                updated_user = await payment_service.remnawave_client.set_user_expire_at(
-                    telegram_id=telegram_id,
-                    expire_at=disabled_dt,
-                )
-                if updated_user:
-                    await customer_repo.update_fields(
-                        customer.id,
-                        {"expire_at": updated_user.expire_at.isoformat(), "subscription_link": updated_user.subscription_url},
-                    )
-                else:
-                    await customer_repo.update_fields(customer.id, {"expire_at": disabled_dt.isoformat()})
-                panel_state.pop(message.from_user.id, None)
-                await message.answer(
-                    tm.get_text(lang, "admin_sub_disabled_done") % telegram_id,
-                    parse_mode="HTML",
-                )
-                await _send_log_message(
-                    "⛔ <b>Админ отключил подписку</b>\n"
-                    f"• <b>Админ:</b> <code>{message.from_user.id}</code>\n"
-                    f"• <b>Пользователь:</b> <code>{telegram_id}</code>\n"
-                    f"• <b>Время (UTC):</b> <code>{_utc_now_text()}</code>"
-                )
-                return
-
-            if step == "await_broadcast_source":
-                await _save_broadcast_source_message(message, lang)
-                return
-
-            if step == "await_broadcast_button_text":
-                state["button_text"] = text_val
-                state["step"] = "broadcast_idle"
-                await message.answer(
-                    _broadcast_button_settings_text(lang, state),
-                    reply_markup=_admin_broadcast_button_keyboard(lang, state),
-                    parse_mode="HTML",
-                )
-                return
-
-            if step == "await_broadcast_button_url":
-                if not _is_valid_broadcast_button_url(text_val):
-                    await message.answer(tm.get_text(lang, "admin_broadcast_button_url_invalid"), parse_mode="HTML")
-                    return
-                state["button_url"] = text_val
-                state["step"] = "broadcast_idle"
-                await message.answer(
-                    _broadcast_button_settings_text(lang, state),
-                    reply_markup=_admin_broadcast_button_keyboard(lang, state),
-                    parse_mode="HTML",
-                )
-                return
-
-            if step == "await_broadcast_button_emoji":
-                state["button_emoji_id"] = text_val
-                state["step"] = "broadcast_idle"
-                await message.answer(
-                    _broadcast_button_settings_text(lang, state),
-                    reply_markup=_admin_broadcast_button_keyboard(lang, state),
-                    parse_mode="HTML",
-                )
-                return
-
-            if step == "await_price_value":
-                key = state.get("key")
-                if key not in PRICE_FIELD_ORDER:
-                    panel_state.pop(message.from_user.id, None)
-                    return
-                try:
-                    value = int(text_val)
-                except ValueError:
-                    await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
-                    return
-                if value < 0:
-                    await message.answer(tm.get_text(lang, "admin_invalid_number"), parse_mode="HTML")
-                    return
-                await price_repo.set_value(key, value, message.from_user.id)
-                setattr(config, key, value)
-                panel_state.pop(message.from_user.id, None)
-                label = PRICE_FIELD_LABELS.get(key, key)
-                await message.answer(
-                    tm.get_text(lang, "admin_price_updated") % (label, value),
-                    parse_mode="HTML",
-                )
-                await _send_log_message(
-                    "💸 <b>Админ изменил цену</b>\n"
-                    f"• <b>Админ:</b> <code>{message.from_user.id}</code>\n"
-                    f"• <b>Поле:</b> <b>{html.escape(label)}</b>\n"
-                    f"• <b>Новое значение:</b> <code>{value}</code>\n"
-                    f"• <b>Время (UTC):</b> <code>{_utc_now_text()}</code>"
-                )
-                return
 
         # Promo admin creation flow.
-        if _is_admin(message.from_user.id) and message.from_user.id in promo_admin_state:
-            state = promo_admin_state[message.from_user.id]
-            if state.get("step") == "choose_type":
+        if is_admin and uid in promo_admin_state:
+            state = promo_admin_state[uid]
+            step = state.get("step")
+            if step == "choose_type":
                 await message.answer(tm.get_text(lang, "promo_create_choose_type"), parse_mode="HTML")
                 return
-            if state.get("step") in {"await_days", "await_gb", "await_uses"}:
-                try:
-                    value = int(text_val)
-                except ValueError:
+            promo_handler = promo_step_handlers.get(step)
+            if promo_handler:
+                value = _parse_int(text_val)
+                if value is None:
                     await message.answer(tm.get_text(lang, "promo_invalid_number"), parse_mode="HTML")
                     return
-
-            if state.get("step") == "await_days":
-                if value < 0:
-                    await message.answer(tm.get_text(lang, "promo_invalid_number"), parse_mode="HTML")
-                    return
-                promo_admin_state[message.from_user.id] = {"step": "await_uses", "days": value, "gb": 0}
-                await message.answer(tm.get_text(lang, "promo_enter_uses"), parse_mode="HTML")
-                return
-            if state.get("step") == "await_gb":
-                if value < 0:
-                    await message.answer(tm.get_text(lang, "promo_invalid_number"), parse_mode="HTML")
-                    return
-                promo_admin_state[message.from_user.id] = {"step": "await_uses", "days": 0, "gb": value}
-                await message.answer(tm.get_text(lang, "promo_enter_uses"), parse_mode="HTML")
-                return
-            if state.get("step") == "await_uses":
-                days = state.get("days", 0)
-                gb = state.get("gb", 0)
-                uses = max(1, value)
-                code = ""
-                while not code:
-                    candidate = "PROMO-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-                    existing = await promo_repo.find_by_code(candidate)
-                    if not existing:
-                        code = candidate
-                promo = await promo_repo.create(code.upper(), days, gb, uses, message.from_user.id)
-                promo_admin_state.pop(message.from_user.id, None)
-                await message.answer(
-                    tm.get_text(lang, "promo_admin_created") % (promo.code, promo.days, promo.traffic_gb, promo.max_uses),
-                    parse_mode="HTML",
-                )
+                await promo_handler(message, uid, state, lang, value)
                 return
 
         # User promo redemption flow.
-        if message.from_user.id not in pending_promo:
+        if uid not in pending_promo:
             return
-        pending_promo.discard(message.from_user.id)
-        customer = await customer_repo.find_by_telegram_id(message.from_user.id)
+        pending_promo.discard(uid)
+        customer = await customer_repo.find_by_telegram_id(uid)
         if not customer:
             return
-        markup = InlineKeyboardMarkup(inline_keyboard=start_keyboard(customer, lang, tm))
+        markup = start_markup(customer, lang, tm)
         status = await payment_service.apply_promo_code(customer, message.text, message.from_user.username)
         if status == "ok":
             await message.answer(tm.get_text(lang, "promo_ok"), reply_markup=markup, parse_mode="HTML")
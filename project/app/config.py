@@ -2,7 +2,7 @@ import os
 import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, FrozenSet, List, Optional, Set
 
 from dotenv import load_dotenv
 
@@ -38,6 +38,11 @@ def _as_int(value: Optional[str], default: int = 0) -> int:
         return default
 
 
+def _as_synchronous(value: Optional[str], default: str = "NORMAL") -> str:
+    mode = (value or "").strip().upper()
+    return mode if mode in {"OFF", "NORMAL", "FULL", "EXTRA"} else default
+
+
 def _parse_int_list(raw: str) -> Set[int]:
     result: Set[int] = set()
     if not raw:
@@ -84,8 +89,9 @@ def _parse_headers(raw: str) -> Dict[str, str]:
     return headers
 
 
-@dataclass
+@dataclass(slots=True)
 class Config:
+    # Not frozen: prices and bot_url are updated at runtime from the DB and getMe.
     bot_token: str
     db_path: Path
 
@@ -156,10 +162,10 @@ class Config:
     tos_url: str = ""
 
     admin_telegram_id: int = 0
-    notify_telegram_ids: Set[int] = field(default_factory=set)
+    notify_telegram_ids: FrozenSet[int] = field(default_factory=frozenset)
     log_group_id: int = -1003299002180
-    log_chat_ids: Set[int] = field(default_factory=set)
-    report_chat_ids: Set[int] = field(default_factory=set)
+    log_chat_ids: FrozenSet[int] = field(default_factory=frozenset)
+    report_chat_ids: FrozenSet[int] = field(default_factory=frozenset)
     stats_timezone: str = "Asia/Yekaterinburg"
     daily_stats_hour: int = 9
     daily_traffic_report_hour: int = 7
@@ -174,11 +180,13 @@ class Config:
     squad_uuids: Dict[uuid.UUID, uuid.UUID] = field(default_factory=dict)
     external_squad_uuid: Optional[uuid.UUID] = None
 
-    blocked_telegram_ids: Set[int] = field(default_factory=set)
-    whitelisted_telegram_ids: Set[int] = field(default_factory=set)
+    blocked_telegram_ids: FrozenSet[int] = field(default_factory=frozenset)
+    whitelisted_telegram_ids: FrozenSet[int] = field(default_factory=frozenset)
 
     enable_auto_payment: bool = False
     health_check_port: int = 8080
+    # SQLite PRAGMA synchronous; OFF trades crash durability for cheaper commits.
+    db_synchronous: str = "NORMAL"
 
     tribute_webhook_url: str = ""
     tribute_api_key: str = ""
@@ -189,21 +197,17 @@ class Config:
     moynalog_username: str = ""
     moynalog_password: str = ""
 
-    @property
-    def traffic_limit_bytes(self) -> int:
-        return self.traffic_limit_gb * 1_073_741_824
-
-    @property
-    def trial_traffic_limit_bytes(self) -> int:
-        return self.trial_traffic_limit_gb * 1_073_741_824
-
-    @property
-    def duo_traffic_limit_bytes(self) -> int:
-        return self.duo_traffic_limit_gb * 1_073_741_824
+    traffic_limit_bytes: int = field(init=False)
+    trial_traffic_limit_bytes: int = field(init=False)
+    duo_traffic_limit_bytes: int = field(init=False)
+    family_traffic_limit_bytes: int = field(init=False)
 
-    @property
-    def family_traffic_limit_bytes(self) -> int:
-        return self.family_traffic_limit_gb * 1_073_741_824
+    def __post_init__(self) -> None:
+        # GB limits never change after load, so convert them to bytes once.
+        self.traffic_limit_bytes = self.traffic_limit_gb * 1_073_741_824
+        self.trial_traffic_limit_bytes = self.trial_traffic_limit_gb * 1_073_741_824
+        self.duo_traffic_limit_bytes = self.duo_traffic_limit_gb * 1_073_741_824
+        self.family_traffic_limit_bytes = self.family_traffic_limit_gb * 1_073_741_824
 
     @classmethod
     def load(cls) -> "Config":
@@ -313,10 +317,10 @@ class Config:
             support_url=os.getenv("SUPPORT_URL", ""),
             tos_url=os.getenv("TOS_URL", ""),
             admin_telegram_id=admin_telegram_id,
-            notify_telegram_ids=notify_telegram_ids,
+            notify_telegram_ids=frozenset(notify_telegram_ids),
             log_group_id=log_group_id,
-            log_chat_ids=log_chat_ids,
-            report_chat_ids=report_chat_ids,
+            log_chat_ids=frozenset(log_chat_ids),
+            report_chat_ids=frozenset(report_chat_ids),
             stats_timezone=os.getenv("STATS_TIMEZONE", "Asia/Yekaterinburg"),
             daily_stats_hour=_as_int(os.getenv("DAILY_STATS_HOUR"), 9),
             daily_traffic_report_hour=_as_int(os.getenv("DAILY_TRAFFIC_REPORT_HOUR"), 7),
@@ -328,10 +332,11 @@ class Config:
             days_in_month=_as_int(os.getenv("DAYS_IN_MONTH"), 30),
             squad_uuids=_parse_uuid_map(os.getenv("SQUAD_UUIDS", "")),
             external_squad_uuid=uuid.UUID(external_squad_uuid) if external_squad_uuid else None,
-            blocked_telegram_ids=_parse_int_list(os.getenv("BLOCKED_TELEGRAM_IDS", "")),
-            whitelisted_telegram_ids=_parse_int_list(os.getenv("WHITELISTED_TELEGRAM_IDS", "")),
+            blocked_telegram_ids=frozenset(_parse_int_list(os.getenv("BLOCKED_TELEGRAM_IDS", ""))),
+            whitelisted_telegram_ids=frozenset(_parse_int_list(os.getenv("WHITELISTED_TELEGRAM_IDS", ""))),
             enable_auto_payment=_as_bool(os.getenv("ENABLE_AUTO_PAYMENT")),
             health_check_port=_as_int(os.getenv("HEALTH_CHECK_PORT"), 8080),
+            db_synchronous=_as_synchronous(os.getenv("DB_SYNCHRONOUS")),
             tribute_webhook_url=os.getenv("TRIBUTE_WEBHOOK_URL", ""),
             tribute_api_key=os.getenv("TRIBUTE_API_KEY", ""),
             tribute_payment_url=os.getenv("TRIBUTE_PAYMENT_URL", ""),
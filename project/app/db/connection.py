@@ -1,23 +1,57 @@
 import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional
 
 import aiosqlite
 
 _db: Optional[aiosqlite.Connection] = None
+_readers: Optional["asyncio.Queue[aiosqlite.Connection]"] = None
+_reader_conns: List[aiosqlite.Connection] = []
 _lock = asyncio.Lock()
+_write_locks: Dict[aiosqlite.Connection, asyncio.Lock] = {}
 
+READER_POOL_SIZE = 4
+# sqlite3 keeps compiled statements per connection keyed by SQL text; the default of 128 is
+# smaller than the number of distinct repository queries plus generated UPDATE shapes.
+STATEMENT_CACHE_SIZE = 256
 
-async def init_db(path: Path) -> aiosqlite.Connection:
-    """Initialize a shared aiosqlite connection with sane pragmas."""
-    global _db
+
+async def _apply_pragmas(conn: aiosqlite.Connection) -> None:
+    conn.row_factory = aiosqlite.Row
+    await conn.execute("PRAGMA foreign_keys = ON;")
+    await conn.execute("PRAGMA temp_store = MEMORY;")
+    await conn.execute("PRAGMA mmap_size = 268435456;")
+    await conn.execute("PRAGMA cache_size = -65536;")
+    await conn.execute("PRAGMA busy_timeout = 5000;")
+
+
+async def init_db(
+    path: Path, readers: int = READER_POOL_SIZE, synchronous: str = "NORMAL"
+) -> aiosqlite.Connection:
+    """Initialize a shared aiosqlite connection with sane pragmas.
+
+    A small pool of read-only connections is opened next to it so long report
+    queries do not queue behind the shared connection's worker thread.
+    """
+    global _db, _readers
     async with _lock:
         if _db is None:
-            _db = await aiosqlite.connect(path)
-            _db.row_factory = aiosqlite.Row
-            await _db.execute("PRAGMA foreign_keys = ON;")
+            _db = await aiosqlite.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+            await _apply_pragmas(_db)
             await _db.execute("PRAGMA journal_mode = WAL;")
-            await _db.execute("PRAGMA synchronous = NORMAL;")
+            # main.wal_checkpoint_task truncates the log periodically, so inline checkpoints can be rarer.
+            await _db.execute("PRAGMA wal_autocheckpoint = 10000;")
+            await _db.execute(f"PRAGMA synchronous = {synchronous};")
+            await _db.commit()
+            if readers > 0 and str(path) != ":memory:":
+                _readers = asyncio.Queue()
+                uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+                for _ in range(readers):
+                    conn = await aiosqlite.connect(uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+                    await _apply_pragmas(conn)
+                    _reader_conns.append(conn)
+                    _readers.put_nowait(conn)
     return _db
 
 
@@ -27,10 +61,59 @@ async def get_db() -> aiosqlite.Connection:
     return _db
 
 
+@asynccontextmanager
+async def acquire_reader() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a read-only connection, falling back to the shared one when no pool is open."""
+    if _readers is None:
+        yield await get_db()
+        return
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+
+def write_lock(conn: aiosqlite.Connection) -> asyncio.Lock:
+    """The single lock all repositories hold around their writes on ``conn``.
+
+    SQLite allows one writer per database, so per-repository locks only let statements
+    from different repositories interleave inside each other's transactions.
+    """
+    lock = _write_locks.get(conn)
+    if lock is None:
+        lock = _write_locks[conn] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def write_transaction(conn: aiosqlite.Connection) -> AsyncIterator[aiosqlite.Connection]:
+    """Hold ``write_lock(conn)`` and commit on exit, rolling back if the block raises.
+
+    sqlite3 opens a transaction implicitly before the first write, so a writer that
+    bails out without either would leave it open for the next writer's commit.
+    """
+    async with write_lock(conn):
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+
+
 async def close_db() -> None:
-    global _db
+    global _db, _readers
     async with _lock:
+        for conn in _reader_conns:
+            await conn.close()
+        _reader_conns.clear()
+        _readers = None
+        _write_locks.clear()
         if _db is not None:
+            try:
+                await _db.execute("PRAGMA optimize;")
+            except aiosqlite.Error:
+                pass
             await _db.close()
             _db = None
-
@@ -1,9 +1,91 @@
 import aiosqlite
 
+# Bumped whenever a one-time data migration or a CREATE_SCHEMA change is added; stored in
+# PRAGMA user_version.
+SCHEMA_VERSION = 13
 
-CREATE_SCHEMA = """
-PRAGMA foreign_keys = ON;
+# Integer copy of customer.expire_at so expiry range checks compare and index plain integers;
+# strftime also normalizes the mixed 'T'/space and offset forms stored in expire_at.
+_EXPIRE_AT_TS_DDL = "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', expire_at) AS INTEGER)) VIRTUAL"
+
+# Columns added after the first release; older databases get them via ALTER TABLE.
+OPTIONAL_COLUMNS = (
+    ("purchase", "plan", "TEXT"),
+    ("purchase", "platega_transaction_id", "TEXT"),
+    ("purchase", "platega_redirect_url", "TEXT"),
+    ("customer", "username", "TEXT"),
+    ("customer", "language_selected", "INTEGER NOT NULL DEFAULT 0"),
+    ("customer", "notifications_enabled", "INTEGER NOT NULL DEFAULT 1"),
+    ("customer", "broadcast_enabled", "INTEGER NOT NULL DEFAULT 1"),
+    ("customer", "expire_at_ts", _EXPIRE_AT_TS_DDL),
+    ("customer", "first_paid_at", "INTEGER"),
+    ("sales_log", "paid_at_ts", "INTEGER"),
+    ("sales_log", "is_stars", "INTEGER NOT NULL DEFAULT 0"),
+    ("sales_log", "amount_rub_kopecks", "INTEGER"),
+    ("purchase", "gift_sender_telegram_id", "INTEGER"),
+    ("purchase", "gift_recipient_telegram_id", "INTEGER"),
+    ("promo_code", "traffic_gb", "INTEGER NOT NULL DEFAULT 0"),
+    ("promo_code", "created_by", "INTEGER"),
+    ("promo_code", "created_at", "TEXT DEFAULT CURRENT_TIMESTAMP"),
+)
+
+_COMPAT_TABLES = tuple(sorted({table for table, _, _ in OPTIONAL_COLUMNS}))
 
+# Indexes over columns that older databases may still lack; created only once those columns exist.
+OPTIONAL_INDEXES = (
+    (
+        "purchase",
+        ("invoice_type", "status"),
+        "CREATE INDEX IF NOT EXISTS idx_purchase_invoice_type_status ON purchase(invoice_type, status)",
+    ),
+    (
+        "purchase",
+        ("customer_id", "status", "paid_at"),
+        "CREATE INDEX IF NOT EXISTS idx_purchase_customer_status_paid ON purchase(customer_id, status, paid_at)",
+    ),
+    (
+        "purchase",
+        ("status", "paid_at"),
+        "CREATE INDEX IF NOT EXISTS idx_purchase_status_paid_at ON purchase(status, paid_at)",
+    ),
+    (
+        "purchase",
+        ("paid_at", "amount", "status"),
+        "CREATE INDEX IF NOT EXISTS ix_purchase_paid_status ON purchase(paid_at, amount) "
+        "WHERE status = 'paid' AND paid_at IS NOT NULL",
+    ),
+    (
+        "purchase",
+        ("customer_id", "created_at", "invoice_type"),
+        "CREATE INDEX IF NOT EXISTS ix_purchase_tribute ON purchase(customer_id, created_at DESC) "
+        "WHERE invoice_type = 'tribute'",
+    ),
+    (
+        "purchase",
+        ("platega_transaction_id",),
+        "CREATE INDEX IF NOT EXISTS idx_purchase_platega_transaction ON purchase(platega_transaction_id)",
+    ),
+    (
+        "customer",
+        ("expire_at_ts",),
+        "CREATE INDEX IF NOT EXISTS ix_customer_expire_active ON customer(expire_at_ts, telegram_id) "
+        "WHERE expire_at_ts IS NOT NULL",
+    ),
+    (
+        "customer",
+        ("first_paid_at",),
+        "CREATE INDEX IF NOT EXISTS ix_customer_first_paid_at ON customer(first_paid_at) "
+        "WHERE first_paid_at IS NOT NULL",
+    ),
+    (
+        "sales_log",
+        ("paid_at_ts", "is_stars", "amount_rub_kopecks"),
+        "CREATE INDEX IF NOT EXISTS idx_sales_log_period "
+        "ON sales_log(paid_at_ts, is_new_customer, is_stars, amount, amount_rub_kopecks)",
+    ),
+)
+
+CREATE_SCHEMA = """
 CREATE TABLE IF NOT EXISTS customer (
     id                INTEGER PRIMARY KEY AUTOINCREMENT,
     telegram_id       INTEGER UNIQUE,
@@ -14,10 +96,13 @@ CREATE TABLE IF NOT EXISTS customer (
     username          TEXT,
     language_selected INTEGER NOT NULL DEFAULT 0,
     notifications_enabled INTEGER NOT NULL DEFAULT 1,
-    broadcast_enabled INTEGER NOT NULL DEFAULT 1
+    broadcast_enabled INTEGER NOT NULL DEFAULT 1,
+    expire_at_ts      INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', expire_at) AS INTEGER)) VIRTUAL,
+    first_paid_at     INTEGER
 );
 
 CREATE INDEX IF NOT EXISTS idx_customer_telegram_id ON customer(telegram_id);
+CREATE INDEX IF NOT EXISTS ix_customer_created_at ON customer(created_at);
 
 CREATE TABLE IF NOT EXISTS purchase (
     id                 INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,6 +126,7 @@ CREATE TABLE IF NOT EXISTS purchase (
     platega_redirect_url   TEXT
 );
 
+
 CREATE TABLE IF NOT EXISTS sales_log (
     id               INTEGER PRIMARY KEY AUTOINCREMENT,
     purchase_id      INTEGER UNIQUE NOT NULL REFERENCES purchase(id) ON DELETE CASCADE,
@@ -53,10 +139,14 @@ CREATE TABLE IF NOT EXISTS sales_log (
     plan             TEXT,
     is_new_customer  INTEGER NOT NULL DEFAULT 0,
     paid_at          TEXT NOT NULL,
-    created_at       TEXT DEFAULT CURRENT_TIMESTAMP
+    created_at       TEXT DEFAULT CURRENT_TIMESTAMP,
+    paid_at_ts       INTEGER,
+    is_stars         INTEGER NOT NULL DEFAULT 0,
+    amount_rub_kopecks INTEGER
 );
 
-CREATE INDEX IF NOT EXISTS idx_sales_log_paid_at ON sales_log(paid_at);
+-- Period reports use idx_sales_log_period (see OPTIONAL_INDEXES).
+DROP INDEX IF EXISTS idx_sales_log_paid_at;
 CREATE INDEX IF NOT EXISTS idx_sales_log_telegram_id ON sales_log(telegram_id);
 
 CREATE TABLE IF NOT EXISTS price_setting (
@@ -79,8 +169,11 @@ CREATE TABLE IF NOT EXISTS gift_notification (
     delivered_at          TEXT
 );
 
-CREATE INDEX IF NOT EXISTS idx_gift_notification_recipient_delivered
-    ON gift_notification(recipient_telegram_id, delivered);
+-- Pending gifts per recipient, already in delivery order.
+CREATE INDEX IF NOT EXISTS ix_gift_notification_pending
+    ON gift_notification(recipient_telegram_id, created_at)
+    WHERE delivered = 0;
+DROP INDEX IF EXISTS idx_gift_notification_recipient_delivered;
 
 CREATE TABLE IF NOT EXISTS duo_purchase_member (
     id                  INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -123,239 +216,199 @@ CREATE TABLE IF NOT EXISTS promo_redemption (
     used_at     TEXT DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(promo_id, customer_id)
 );
+
+-- Counters kept current by triggers so hot dashboards read one row instead of COUNT(*).
+CREATE TABLE IF NOT EXISTS stats (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO stats (key, value) VALUES ('customer_count', (SELECT COUNT(*) FROM customer));
+
+CREATE TRIGGER IF NOT EXISTS trg_customer_count_insert AFTER INSERT ON customer
+BEGIN
+    UPDATE stats SET value = value + 1 WHERE key = 'customer_count';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_customer_count_delete AFTER DELETE ON customer
+BEGIN
+    UPDATE stats SET value = value - 1 WHERE key = 'customer_count';
+END;
+
+-- Paid purchases shaped like sales_log rows; used to backfill sales_log on older databases.
+CREATE VIEW IF NOT EXISTS v_sales_log_backfill AS
+WITH paid AS (
+    SELECT
+        p.*,
+        MIN(p.paid_at) OVER (PARTITION BY p.customer_id) AS first_paid_at
+    FROM purchase p
+    WHERE p.status = 'paid'
+)
+SELECT
+    paid.id AS purchase_id,
+    paid.customer_id,
+    c.telegram_id,
+    paid.amount,
+    paid.currency,
+    paid.amount AS amount_rub,
+    paid.invoice_type,
+    paid.plan,
+    CASE
+        WHEN paid.paid_at IS NOT NULL AND paid.paid_at = paid.first_paid_at THEN 1
+        ELSE 0
+    END AS is_new_customer,
+    COALESCE(paid.paid_at, paid.created_at) AS paid_at
+FROM paid
+JOIN customer c ON c.id = paid.customer_id;
 """
 
 
 async def run_migrations(db: aiosqlite.Connection) -> None:
     """Apply the minimal schema required for the bot."""
-    async def _has_column(table: str, column: str) -> bool:
-        async with db.execute(f"PRAGMA table_info({table})") as cursor:
-            rows = await cursor.fetchall()
-        return any(str(row[1]) == column for row in rows)
+    async def _load_columns(tables: tuple[str, ...]) -> dict[str, set[str]]:
+        columns: dict[str, set[str]] = {}
+        for table in tables:
+            async with db.execute("SELECT name FROM pragma_table_xinfo(?)", (table,)) as cursor:
+                columns[table] = {str(row[0]) async for row in cursor}
+        return columns
 
-    async def _has_columns(table: str, columns: tuple[str, ...]) -> bool:
-        for column in columns:
-            if not await _has_column(table, column):
-                return False
-        return True
+    async def _try_step(sql: str) -> None:
+        # Optional steps may fail on older schemas; roll back just that step, not the whole run.
+        await db.execute("SAVEPOINT migration_step")
+        try:
+            await db.execute(sql)
+        except Exception:
+            await db.execute("ROLLBACK TO migration_step")
+        await db.execute("RELEASE migration_step")
 
-    await db.executescript(CREATE_SCHEMA)
-    try:
-        await db.execute("ALTER TABLE purchase ADD COLUMN plan TEXT")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE purchase ADD COLUMN platega_transaction_id TEXT")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE purchase ADD COLUMN platega_redirect_url TEXT")
-    except Exception:
-        pass
-    try:
-        if await _has_columns("purchase", ("invoice_type", "status")):
-            await db.execute(
-                "CREATE INDEX IF NOT EXISTS idx_purchase_invoice_type_status ON purchase(invoice_type, status)"
-            )
-    except Exception:
-        pass
-    try:
-        if await _has_column("purchase", "platega_transaction_id"):
-            await db.execute(
-                "CREATE INDEX IF NOT EXISTS idx_purchase_platega_transaction ON purchase(platega_transaction_id)"
-            )
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE customer ADD COLUMN username TEXT")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE customer ADD COLUMN language_selected INTEGER NOT NULL DEFAULT 0")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE customer ADD COLUMN notifications_enabled INTEGER NOT NULL DEFAULT 1")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE customer ADD COLUMN broadcast_enabled INTEGER NOT NULL DEFAULT 1")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE purchase ADD COLUMN gift_sender_telegram_id INTEGER")
-    except Exception:
-        pass
-    try:
-        await db.execute("ALTER TABLE purchase ADD COLUMN gift_recipient_telegram_id INTEGER")
-    except Exception:
-        pass
-    try:
-        await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_referral_pair ON referral(referrer_id, referee_id)")
-    except Exception:
-        pass
-    # Backward-compat for old promo_code schema versions.
-    try:
-        if not await _has_column("promo_code", "traffic_gb"):
-            await db.execute("ALTER TABLE promo_code ADD COLUMN traffic_gb INTEGER NOT NULL DEFAULT 0")
-    except Exception:
-        pass
-    try:
-        if not await _has_column("promo_code", "created_by"):
-            await db.execute("ALTER TABLE promo_code ADD COLUMN created_by INTEGER")
-    except Exception:
-        pass
-    try:
-        if not await _has_column("promo_code", "created_at"):
-            await db.execute("ALTER TABLE promo_code ADD COLUMN created_at TEXT DEFAULT CURRENT_TIMESTAMP")
-    except Exception:
-        pass
-    try:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS promo_code (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                code        TEXT UNIQUE NOT NULL,
-                days        INTEGER NOT NULL DEFAULT 0,
-                traffic_gb  INTEGER NOT NULL DEFAULT 0,
-                max_uses    INTEGER NOT NULL DEFAULT 1,
-                used        INTEGER NOT NULL DEFAULT 0,
-                created_at  TEXT DEFAULT CURRENT_TIMESTAMP,
-                created_by  INTEGER
-            )
-            """
-        )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS promo_redemption (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                promo_id    INTEGER NOT NULL REFERENCES promo_code(id) ON DELETE CASCADE,
-                customer_id INTEGER NOT NULL REFERENCES customer(id) ON DELETE CASCADE,
-                used_at     TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(promo_id, customer_id)
+    # journal_mode can't change inside a transaction; the other pragmas are cheap to re-assert
+    # and apply to the connection even when there is nothing to migrate.
+    async with db.execute("PRAGMA journal_mode") as cursor:
+        row = await cursor.fetchone()
+    if not row or str(row[0]).lower() != "wal":
+        await db.execute("PRAGMA journal_mode = WAL")
+    # foreign_keys is per-connection and a no-op inside a transaction, so it can't live in CREATE_SCHEMA.
+    await db.execute("PRAGMA foreign_keys = ON")
+    await db.execute("PRAGMA temp_store = MEMORY")
+
+    async with db.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+    version = int(row[0]) if row else 0
+
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer'") as cursor:
+        has_schema = await cursor.fetchone() is not None
+    if has_schema and version >= SCHEMA_VERSION:
+        # Schema, compat columns and data migrations were all applied by an earlier run.
+        return
+    if not has_schema:
+        # Fresh database: CREATE_SCHEMA already has every column, so there is nothing to
+        # ALTER or backfill.
+        await db.executescript(
+            "\n".join(
+                [
+                    "BEGIN IMMEDIATE;",
+                    CREATE_SCHEMA,
+                    *(f"{sql};" for _, _, sql in OPTIONAL_INDEXES),
+                    f"PRAGMA user_version = {SCHEMA_VERSION};",
+                    "COMMIT;",
+                ]
             )
-            """
         )
-    except Exception:
-        pass
+        return
+
+    async with db.execute("PRAGMA cache_size") as cursor:
+        row = await cursor.fetchone()
+    runtime_cache_size = int(row[0]) if row else -2000
+    # A larger page cache for the backfill scan; restored once the migration is done.
+    await db.execute("PRAGMA cache_size = -65536")
+
+    # executescript commits on its own, so the base schema goes in before the transaction opens.
+    await db.executescript(CREATE_SCHEMA)
+    # One snapshot of the columns the compat checks below care about.
+    cols = await _load_columns(_COMPAT_TABLES)
+    missing = [(table, column, ddl) for table, column, ddl in OPTIONAL_COLUMNS if column not in cols[table]]
+    alters = [f"ALTER TABLE {table} ADD COLUMN {column} {ddl};" for table, column, ddl in missing]
+    for table, column, _ in missing:
+        cols[table].add(column)
+    indexes = [f"{sql};" for table, required, sql in OPTIONAL_INDEXES if cols[table].issuperset(required)]
     try:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sales_log (
-                id               INTEGER PRIMARY KEY AUTOINCREMENT,
-                purchase_id      INTEGER UNIQUE NOT NULL REFERENCES purchase(id) ON DELETE CASCADE,
-                customer_id      INTEGER NOT NULL REFERENCES customer(id) ON DELETE CASCADE,
-                telegram_id      INTEGER NOT NULL,
-                amount           REAL NOT NULL,
-                currency         TEXT,
-                amount_rub       REAL NOT NULL,
-                invoice_type     TEXT,
-                plan             TEXT,
-                is_new_customer  INTEGER NOT NULL DEFAULT 0,
-                paid_at          TEXT NOT NULL,
-                created_at       TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_sales_log_paid_at ON sales_log(paid_at)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_sales_log_telegram_id ON sales_log(telegram_id)")
+        # The script opens the migration transaction itself, so all ALTERs and indexes land in one hop.
+        await db.executescript("\n".join(["BEGIN IMMEDIATE;", *alters, *indexes]))
     except Exception:
-        pass
+        # Some legacy tables reject an ALTER (e.g. non-constant defaults on non-empty
+        # tables); retry one by one so the rest still apply.
+        await db.rollback()
+        await db.execute("BEGIN IMMEDIATE")
+        for sql in alters:
+            await _try_step(sql)
+        cols = await _load_columns(_COMPAT_TABLES)
+        for table, required, sql in OPTIONAL_INDEXES:
+            if cols[table].issuperset(required):
+                await _try_step(sql)
     try:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS price_setting (
-                key         TEXT PRIMARY KEY,
-                value       INTEGER NOT NULL,
-                updated_at  TEXT DEFAULT CURRENT_TIMESTAMP,
-                updated_by  INTEGER
+        if version < 1:
+            # One-time sales_log backfill from purchases paid before sales_log existed.
+            await _try_step(
+                """
+                INSERT INTO sales_log (
+                    purchase_id, customer_id, telegram_id, amount, currency, amount_rub,
+                    invoice_type, plan, is_new_customer, paid_at
+                )
+                SELECT b.*
+                FROM v_sales_log_backfill b
+                WHERE NOT EXISTS (SELECT 1 FROM sales_log s WHERE s.purchase_id = b.purchase_id)
+                """,
             )
-            """
-        )
-    except Exception:
-        pass
-    try:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS gift_notification (
-                id                    INTEGER PRIMARY KEY AUTOINCREMENT,
-                recipient_telegram_id INTEGER NOT NULL,
-                sender_telegram_id    INTEGER,
-                months                INTEGER NOT NULL DEFAULT 0,
-                days                  INTEGER NOT NULL DEFAULT 0,
-                message               TEXT NOT NULL,
-                purchase_id           INTEGER REFERENCES purchase(id) ON DELETE SET NULL,
-                delivered             INTEGER NOT NULL DEFAULT 0,
-                created_at            TEXT DEFAULT CURRENT_TIMESTAMP,
-                delivered_at          TEXT
+        if version < 7:
+            # Seed customer.first_paid_at (unix seconds) from the purchase history.
+            await _try_step(
+                """
+                UPDATE customer
+                SET first_paid_at = (
+                    SELECT CAST(strftime('%s', MIN(p.paid_at)) AS INTEGER)
+                    FROM purchase p
+                    WHERE p.customer_id = customer.id
+                      AND p.status = 'paid'
+                      AND p.paid_at IS NOT NULL
+                )
+                WHERE first_paid_at IS NULL
+                """,
             )
-            """
-        )
-        await db.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_gift_notification_recipient_delivered
-            ON gift_notification(recipient_telegram_id, delivered)
-            """
-        )
-    except Exception:
-        pass
-    try:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS duo_purchase_member (
-                id                  INTEGER PRIMARY KEY AUTOINCREMENT,
-                purchase_id         INTEGER NOT NULL REFERENCES purchase(id) ON DELETE CASCADE,
-                member_telegram_id  INTEGER NOT NULL,
-                created_at          TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(purchase_id, member_telegram_id)
+        if version < 10:
+            # Plain column rather than a generated one so the report index can cover it.
+            await _try_step(
+                """
+                UPDATE sales_log
+                SET paid_at_ts = CAST(strftime('%s', paid_at) AS INTEGER)
+                WHERE paid_at_ts IS NULL
+                """,
             )
-            """
-        )
-        await db.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_duo_purchase_member_purchase
-            ON duo_purchase_member(purchase_id)
-            """
-        )
-    except Exception:
-        pass
-    try:
-        await db.execute(
-            """
-            INSERT OR IGNORE INTO sales_log (
-                purchase_id, customer_id, telegram_id, amount, currency, amount_rub,
-                invoice_type, plan, is_new_customer, paid_at
+        if version < 11:
+            await _try_step(
+                """
+                UPDATE sales_log
+                SET is_stars = 1
+                WHERE UPPER(COALESCE(currency, '')) IN ('STARS', 'XTR') AND is_stars = 0
+                """,
             )
-            SELECT
-                p.id,
-                p.customer_id,
-                c.telegram_id,
-                p.amount,
-                p.currency,
-                CASE
-                    WHEN UPPER(COALESCE(p.currency, '')) IN ('STARS', 'XTR') THEN p.amount
-                    ELSE p.amount
-                END AS amount_rub,
-                p.invoice_type,
-                p.plan,
-                CASE
-                    WHEN p.paid_at IS NOT NULL
-                         AND p.paid_at = (
-                            SELECT MIN(p2.paid_at)
-                            FROM purchase p2
-                            WHERE p2.customer_id = p.customer_id
-                              AND p2.status = 'paid'
-                              AND p2.paid_at IS NOT NULL
-                         )
-                    THEN 1
-                    ELSE 0
-                END AS is_new_customer,
-                COALESCE(p.paid_at, p.created_at)
-            FROM purchase p
-            JOIN customer c ON c.id = p.customer_id
-            WHERE p.status = 'paid'
-            """
-        )
+        if version < 12:
+            await _try_step(
+                """
+                UPDATE sales_log
+                SET amount_rub_kopecks = CAST(ROUND(amount_rub * 100) AS INTEGER)
+                WHERE amount_rub_kopecks IS NULL
+                """,
+            )
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if version < 1:
+            # The backfill may have filled sales_log from nothing; gather full stats once.
+            await db.execute("ANALYZE")
+        else:
+            # Refresh planner stats for tables whose indexes or row counts just changed.
+            await db.execute("PRAGMA optimize = 0x10002")
     except Exception:
-        pass
+        await db.rollback()
+        raise
+    finally:
+        await db.execute(f"PRAGMA cache_size = {runtime_cache_size}")
     await db.commit()
@@ -1,14 +1,44 @@
 from __future__ import annotations
 
-import asyncio
-from dataclasses import dataclass
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 
 import aiosqlite
 import sqlite3
 
 from ..config import config
+from .connection import acquire_reader, write_transaction
+
+
+_CUSTOMER_COLUMNS = (
+    "id, telegram_id, expire_at, created_at, subscription_link, language, username, "
+    "language_selected, notifications_enabled, broadcast_enabled"
+)
+_CUSTOMER_SELECT = f"SELECT {_CUSTOMER_COLUMNS} FROM customer"
+_PURCHASE_COLUMNS = (
+    "id, amount, customer_id, created_at, month, paid_at, currency, expire_at, status, invoice_type, "
+    "plan, crypto_invoice_id, crypto_invoice_url, yookasa_url, yookasa_id, gift_sender_telegram_id, "
+    "gift_recipient_telegram_id, platega_transaction_id, platega_redirect_url"
+)
+_PURCHASE_SELECT = f"SELECT {_PURCHASE_COLUMNS} FROM purchase"
+# Table-qualified copies for joins; _PURCHASE_WIDTH is where the customer columns start.
+_PURCHASE_CONTEXT_COLUMNS = ", ".join(f"p.{name.strip()}" for name in _PURCHASE_COLUMNS.split(","))
+_CUSTOMER_CONTEXT_COLUMNS = ", ".join(f"c.{name.strip()}" for name in _CUSTOMER_COLUMNS.split(","))
+_PURCHASE_WIDTH = _PURCHASE_COLUMNS.count(",") + 1
+_SALE_LOG_COLUMNS = (
+    "id, purchase_id, customer_id, telegram_id, amount, currency, amount_rub, invoice_type, plan, "
+    "is_new_customer, paid_at, created_at"
+)
+_GIFT_NOTIFICATION_COLUMNS = (
+    "id, recipient_telegram_id, sender_telegram_id, months, days, message, purchase_id, delivered, "
+    "created_at, delivered_at"
+)
 
 
 def _to_iso(dt: Optional[datetime]) -> Optional[str]:
@@ -17,19 +47,32 @@ def _to_iso(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat()
 
 
+# Unix seconds, comparable with the strftime('%s', ...) columns maintained by the schema.
+def _to_epoch(dt: Optional[datetime]) -> Optional[int]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+_fromisoformat = datetime.fromisoformat
+
+
 def _from_iso(value: Optional[str]) -> Optional[datetime]:
     if value is None:
         return None
     try:
-        dt_val = datetime.fromisoformat(value)
-        if dt_val.tzinfo:
-            dt_val = dt_val.astimezone(timezone.utc).replace(tzinfo=None)
-        return dt_val
+        dt_val = _fromisoformat(value)
     except ValueError:
         return None
+    # Values written by this module are naive UTC already; only foreign rows carry an offset.
+    if dt_val.tzinfo is not None:
+        dt_val = dt_val.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt_val
 
 
-@dataclass
+@dataclass(slots=True)
 class Customer:
     id: int
     telegram_id: int
@@ -43,7 +86,7 @@ class Customer:
     broadcast_enabled: bool = True
 
 
-@dataclass
+@dataclass(slots=True)
 class Purchase:
     id: int
     amount: float
@@ -66,7 +109,7 @@ class Purchase:
     platega_redirect_url: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Referral:
     id: int
     referrer_id: int
@@ -75,13 +118,13 @@ class Referral:
     bonus_granted: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class ReferralDetails:
     referral: Referral
     referee_username: Optional[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class PromoCode:
     id: int
     code: str
@@ -93,7 +136,7 @@ class PromoCode:
     created_by: Optional[int]
 
 
-@dataclass
+@dataclass(slots=True)
 class PromoRedemption:
     id: int
     promo_id: int
@@ -101,7 +144,7 @@ class PromoRedemption:
     used_at: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class SaleLog:
     id: int
     purchase_id: int
@@ -117,7 +160,7 @@ class SaleLog:
     created_at: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class PriceSetting:
     key: str
     value: int
@@ -125,7 +168,7 @@ class PriceSetting:
     updated_by: Optional[int]
 
 
-@dataclass
+@dataclass(slots=True)
 class GiftNotification:
     id: int
     recipient_telegram_id: int
@@ -138,44 +181,77 @@ class GiftNotification:
     created_at: datetime
     delivered_at: Optional[datetime]
 
-def _row_to_customer(row: aiosqlite.Row) -> Customer:
+def _row_to_customer(row: Sequence[Any]) -> Customer:
+    # Positional: every caller selects exactly _CUSTOMER_COLUMNS, in that order.
+    (
+        customer_id,
+        telegram_id,
+        expire_at,
+        created_at,
+        subscription_link,
+        language,
+        username,
+        language_selected,
+        notifications_enabled,
+        broadcast_enabled,
+    ) = row
     return Customer(
-        id=row["id"],
-        telegram_id=row["telegram_id"],
-        expire_at=_from_iso(row["expire_at"]),
-        created_at=_from_iso(row["created_at"]) or datetime.utcnow(),
-        subscription_link=row["subscription_link"],
-        language=row["language"] or config.default_language,
-        username=row["username"] if "username" in row.keys() else None,
-        language_selected=bool(row["language_selected"]) if "language_selected" in row.keys() else False,
-        notifications_enabled=bool(row["notifications_enabled"]) if "notifications_enabled" in row.keys() else True,
-        broadcast_enabled=bool(row["broadcast_enabled"]) if "broadcast_enabled" in row.keys() else True,
+        id=customer_id,
+        telegram_id=telegram_id,
+        expire_at=_from_iso(expire_at),
+        created_at=_from_iso(created_at) or datetime.utcnow(),
+        subscription_link=subscription_link,
+        language=language or config.default_language,
+        username=username,
+        language_selected=bool(language_selected),
+        notifications_enabled=bool(notifications_enabled),
+        broadcast_enabled=bool(broadcast_enabled),
     )
 
 
-def _row_to_purchase(row: aiosqlite.Row) -> Purchase:
+def _row_to_purchase(row: Sequence[Any]) -> Purchase:
+    # Positional: every caller selects exactly _PURCHASE_COLUMNS, in that order.
+    (
+        purchase_id,
+        amount,
+        customer_id,
+        created_at,
+        month,
+        paid_at,
+        currency,
+        expire_at,
+        status,
+        invoice_type,
+        plan,
+        crypto_invoice_id,
+        crypto_invoice_url,
+        yookasa_url,
+        yookasa_id,
+        gift_sender_telegram_id,
+        gift_recipient_telegram_id,
+        platega_transaction_id,
+        platega_redirect_url,
+    ) = row
     return Purchase(
-        id=row["id"],
-        amount=row["amount"],
-        customer_id=row["customer_id"],
-        created_at=_from_iso(row["created_at"]) or datetime.utcnow(),
-        month=row["month"],
-        paid_at=_from_iso(row["paid_at"]),
-        currency=row["currency"],
-        expire_at=_from_iso(row["expire_at"]),
-        status=row["status"],
-        invoice_type=row["invoice_type"],
-        plan=row["plan"] if "plan" in row.keys() else None,
-        crypto_invoice_id=row["crypto_invoice_id"],
-        crypto_invoice_url=row["crypto_invoice_url"],
-        yookasa_url=row["yookasa_url"],
-        yookasa_id=row["yookasa_id"],
-        gift_sender_telegram_id=row["gift_sender_telegram_id"] if "gift_sender_telegram_id" in row.keys() else None,
-        gift_recipient_telegram_id=(
-            row["gift_recipient_telegram_id"] if "gift_recipient_telegram_id" in row.keys() else None
-        ),
-        platega_transaction_id=row["platega_transaction_id"] if "platega_transaction_id" in row.keys() else None,
-        platega_redirect_url=row["platega_redirect_url"] if "platega_redirect_url" in row.keys() else None,
+        id=purchase_id,
+        amount=amount,
+        customer_id=customer_id,
+        created_at=_from_iso(created_at) or datetime.utcnow(),
+        month=month,
+        paid_at=_from_iso(paid_at),
+        currency=currency,
+        expire_at=_from_iso(expire_at),
+        status=status,
+        invoice_type=invoice_type,
+        plan=plan,
+        crypto_invoice_id=crypto_invoice_id,
+        crypto_invoice_url=crypto_invoice_url,
+        yookasa_url=yookasa_url,
+        yookasa_id=yookasa_id,
+        gift_sender_telegram_id=gift_sender_telegram_id,
+        gift_recipient_telegram_id=gift_recipient_telegram_id,
+        platega_transaction_id=platega_transaction_id,
+        platega_redirect_url=platega_redirect_url,
     )
 
 
@@ -194,7 +270,7 @@ def _row_to_promocode(row: aiosqlite.Row) -> PromoCode:
         id=row["id"],
         code=row["code"],
         days=row["days"],
-        traffic_gb=row["traffic_gb"] if "traffic_gb" in row.keys() else 0,
+        traffic_gb=row["traffic_gb"],
         max_uses=row["max_uses"],
         used=row["used"],
         created_at=_from_iso(row["created_at"]) or datetime.utcnow(),
@@ -211,20 +287,35 @@ def _row_to_promo_redemption(row: aiosqlite.Row) -> PromoRedemption:
     )
 
 
-def _row_to_sale_log(row: aiosqlite.Row) -> SaleLog:
+def _row_to_sale_log(row: Sequence[Any]) -> SaleLog:
+    # Positional: every caller selects exactly _SALE_LOG_COLUMNS, in that order.
+    (
+        sale_id,
+        purchase_id,
+        customer_id,
+        telegram_id,
+        amount,
+        currency,
+        amount_rub,
+        invoice_type,
+        plan,
+        is_new_customer,
+        paid_at,
+        created_at,
+    ) = row
     return SaleLog(
-        id=row["id"],
-        purchase_id=row["purchase_id"],
-        customer_id=row["customer_id"],
-        telegram_id=row["telegram_id"],
-        amount=float(row["amount"]),
-        currency=row["currency"],
-        amount_rub=float(row["amount_rub"]),
-        invoice_type=row["invoice_type"],
-        plan=row["plan"],
-        is_new_customer=bool(row["is_new_customer"]),
-        paid_at=_from_iso(row["paid_at"]) or datetime.utcnow(),
-        created_at=_from_iso(row["created_at"]) or datetime.utcnow(),
+        id=sale_id,
+        purchase_id=purchase_id,
+        customer_id=customer_id,
+        telegram_id=telegram_id,
+        amount=float(amount),
+        currency=currency,
+        amount_rub=float(amount_rub),
+        invoice_type=invoice_type,
+        plan=plan,
+        is_new_customer=bool(is_new_customer),
+        paid_at=_from_iso(paid_at) or datetime.utcnow(),
+        created_at=_from_iso(created_at) or datetime.utcnow(),
     )
 
 
@@ -237,44 +328,78 @@ def _row_to_price_setting(row: aiosqlite.Row) -> PriceSetting:
     )
 
 
-def _row_to_gift_notification(row: aiosqlite.Row) -> GiftNotification:
+def _row_to_gift_notification(row: Sequence[Any]) -> GiftNotification:
+    # Positional: every caller selects exactly _GIFT_NOTIFICATION_COLUMNS, in that order.
+    (
+        notification_id,
+        recipient_telegram_id,
+        sender_telegram_id,
+        months,
+        days,
+        message,
+        purchase_id,
+        delivered,
+        created_at,
+        delivered_at,
+    ) = row
     return GiftNotification(
-        id=row["id"],
-        recipient_telegram_id=int(row["recipient_telegram_id"]),
-        sender_telegram_id=row["sender_telegram_id"],
-        months=int(row["months"] or 0),
-        days=int(row["days"] or 0),
-        message=row["message"] or "",
-        purchase_id=row["purchase_id"],
-        delivered=bool(row["delivered"]),
-        created_at=_from_iso(row["created_at"]) or datetime.utcnow(),
-        delivered_at=_from_iso(row["delivered_at"]),
+        id=notification_id,
+        recipient_telegram_id=int(recipient_telegram_id),
+        sender_telegram_id=sender_telegram_id,
+        months=int(months or 0),
+        days=int(days or 0),
+        message=message or "",
+        purchase_id=purchase_id,
+        delivered=bool(delivered),
+        created_at=_from_iso(created_at) or datetime.utcnow(),
+        delivered_at=_from_iso(delivered_at),
     )
 
 
+def _json_ids(values: Iterable[int]) -> str:
+    # Bound as one JSON array parameter, so id lists keep a fixed SQL text and no variable limit.
+    return json.dumps([int(value) for value in values])
+
+
+_first_column = itemgetter(0)
+
+
+def _first_row(rows: Iterable[aiosqlite.Row]) -> Optional[aiosqlite.Row]:
+    return next(iter(rows), None)
+
+
+def _int_column(rows: Iterable[Any]) -> List[int]:
+    # Single-column id lists can be large (broadcasts); read positionally and let map() drive the loop.
+    return list(map(_first_column, rows))
+
+
+@lru_cache(maxsize=128)
+def _update_sql(table: str, keys: Tuple[str, ...]) -> str:
+    # Only a handful of key combinations are ever used, so the SQL text is built once per shape.
+    fields = ", ".join(f"{key} = ?" for key in keys)
+    return f"UPDATE {table} SET {fields} WHERE id = ?"
+
+
+def _update_statement(table: str, row_id: int, updates: Dict[str, Any]) -> Tuple[str, Tuple[Any, ...]]:
+    params = tuple(_to_iso(value) if isinstance(value, datetime) else value for value in updates.values())
+    return _update_sql(table, tuple(updates)), (*params, row_id)
+
+
 class CustomerRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def find_by_expiration_range(self, start_date: datetime, end_date: datetime) -> List[Customer]:
-        query = """
-            SELECT id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                   language_selected, notifications_enabled, broadcast_enabled
-            FROM customer
-            WHERE expire_at IS NOT NULL
-              AND expire_at >= ?
-              AND expire_at <= ?
+        query = _CUSTOMER_SELECT + """
+            WHERE expire_at_ts >= ?
+              AND expire_at_ts <= ?
         """
-        async with self.db.execute(query, (_to_iso(start_date), _to_iso(end_date))) as cursor:
+        async with self.db.execute(query, (_to_epoch(start_date), _to_epoch(end_date))) as cursor:
             rows = await cursor.fetchall()
         return [_row_to_customer(row) for row in rows]
 
     async def find_by_id(self, customer_id: int) -> Optional[Customer]:
-        query = """
-            SELECT id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                   language_selected, notifications_enabled, broadcast_enabled
-            FROM customer
+        query = _CUSTOMER_SELECT + """
             WHERE id = ?
         """
         async with self.db.execute(query, (customer_id,)) as cursor:
@@ -282,10 +407,7 @@ class CustomerRepository:
         return _row_to_customer(row) if row else None
 
     async def find_by_telegram_id(self, telegram_id: int) -> Optional[Customer]:
-        query = """
-            SELECT id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                   language_selected, notifications_enabled, broadcast_enabled
-            FROM customer
+        query = _CUSTOMER_SELECT + """
             WHERE telegram_id = ?
         """
         async with self.db.execute(query, (telegram_id,)) as cursor:
@@ -296,45 +418,61 @@ class CustomerRepository:
         query = "SELECT telegram_id FROM customer ORDER BY id ASC"
         async with self.db.execute(query) as cursor:
             rows = await cursor.fetchall()
-        return [int(row["telegram_id"]) for row in rows]
+        return _int_column(rows)
 
-    async def list_broadcast_enabled_telegram_ids(self) -> List[int]:
+    async def iter_broadcast_enabled_telegram_ids(self, chunk: int = 1024) -> AsyncIterator[List[int]]:
+        # Keyset pages keep every read short, so a broadcast that runs for minutes pins no snapshot.
         query = """
-            SELECT telegram_id
+            SELECT id, telegram_id
             FROM customer
             WHERE broadcast_enabled = 1
+              AND id > ?
             ORDER BY id ASC
+            LIMIT ?
         """
-        async with self.db.execute(query) as cursor:
-            rows = await cursor.fetchall()
-        return [int(row["telegram_id"]) for row in rows]
+        last_id = 0
+        while True:
+            async with acquire_reader() as db, db.execute(query, (last_id, chunk)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [row[1] for row in rows]
+            if len(rows) < chunk:
+                return
 
     async def list_active_telegram_ids(self, now_utc: datetime) -> List[int]:
         query = """
             SELECT telegram_id
             FROM customer
-            WHERE expire_at IS NOT NULL
-              AND expire_at > ?
+            WHERE expire_at_ts > ?
             ORDER BY id ASC
         """
-        async with self.db.execute(query, (_to_iso(now_utc),)) as cursor:
+        async with self.db.execute(query, (_to_epoch(now_utc),)) as cursor:
             rows = await cursor.fetchall()
-        return [int(row["telegram_id"]) for row in rows]
+        return _int_column(rows)
 
     async def list_inactive_telegram_ids(self, now_utc: datetime) -> List[int]:
         query = """
             SELECT telegram_id
             FROM customer
-            WHERE expire_at IS NULL
-               OR expire_at <= ?
+            WHERE expire_at_ts IS NULL
+               OR expire_at_ts <= ?
             ORDER BY id ASC
         """
-        async with self.db.execute(query, (_to_iso(now_utc),)) as cursor:
+        async with self.db.execute(query, (_to_epoch(now_utc),)) as cursor:
             rows = await cursor.fetchall()
-        return [int(row["telegram_id"]) for row in rows]
+        return _int_column(rows)
 
     async def count_all(self) -> int:
-        async with self.db.execute("SELECT COUNT(*) FROM customer") as cursor:
+        # Maintained by the customer insert/delete triggers; see the stats table in migrations.
+        query = """
+            SELECT COALESCE(
+                (SELECT value FROM stats WHERE key = 'customer_count'),
+                (SELECT COUNT(*) FROM customer)
+            )
+        """
+        async with acquire_reader() as db, db.execute(query) as cursor:
             row = await cursor.fetchone()
         return int(row[0]) if row else 0
 
@@ -342,10 +480,9 @@ class CustomerRepository:
         query = """
             SELECT COUNT(*)
             FROM customer
-            WHERE expire_at IS NOT NULL
-              AND expire_at > ?
+            WHERE expire_at_ts > ?
         """
-        async with self.db.execute(query, (_to_iso(now_utc),)) as cursor:
+        async with acquire_reader() as db, db.execute(query, (_to_epoch(now_utc),)) as cursor:
             row = await cursor.fetchone()
         return int(row[0]) if row else 0
 
@@ -356,21 +493,18 @@ class CustomerRepository:
             WHERE created_at >= ?
               AND created_at < ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
+        async with acquire_reader() as db, db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
             row = await cursor.fetchone()
         return int(row[0]) if row else 0
 
     async def list_new_in_period(self, start_utc: datetime, end_utc: datetime, limit: int = 30) -> List[Customer]:
-        query = """
-            SELECT id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                   language_selected, notifications_enabled, broadcast_enabled
-            FROM customer
+        query = _CUSTOMER_SELECT + """
             WHERE created_at >= ?
               AND created_at < ?
             ORDER BY created_at DESC
             LIMIT ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc), limit)) as cursor:
+        async with acquire_reader() as db, db.execute(query, (_to_iso(start_utc), _to_iso(end_utc), limit)) as cursor:
             rows = await cursor.fetchall()
         return [_row_to_customer(row) for row in rows]
 
@@ -379,49 +513,36 @@ class CustomerRepository:
             INSERT INTO customer (telegram_id, language, username, language_selected, notifications_enabled, broadcast_enabled)
             VALUES (?, ?, ?, 0, 1, 1)
             ON CONFLICT(telegram_id) DO UPDATE SET username=excluded.username
-            RETURNING id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                      language_selected, notifications_enabled, broadcast_enabled;
-        """
-        async with self.db.execute(query, (telegram_id, language, None)) as cursor:
-            row = await cursor.fetchone()
-        await self.db.commit()
+            RETURNING
+        """ + _CUSTOMER_COLUMNS
+        async with write_transaction(self.db):
+            async with self.db.execute(query, (telegram_id, language, None)) as cursor:
+                row = await cursor.fetchone()
         return _row_to_customer(row)
 
     async def update_fields(self, customer_id: int, updates: Dict[str, Any]) -> None:
         if not updates:
             return
-        fields = ", ".join(f"{key} = ?" for key in updates.keys())
-        params = []
-        for value in updates.values():
-            if isinstance(value, datetime):
-                params.append(_to_iso(value))
-            else:
-                params.append(value)
-        params.append(customer_id)
-        query = f"UPDATE customer SET {fields} WHERE id = ?"
-        async with self._lock:
-            await self.db.execute(query, tuple(params))
-            await self.db.commit()
+        query, params = _update_statement("customer", customer_id, updates)
+        async with write_transaction(self.db):
+            await self.db.execute(query, params)
 
     async def find_by_telegram_ids(self, telegram_ids: Sequence[int]) -> List[Customer]:
         if not telegram_ids:
             return []
-        placeholders = ",".join("?" for _ in telegram_ids)
-        query = f"""
-            SELECT id, telegram_id, expire_at, created_at, subscription_link, language, username,
-                   language_selected, notifications_enabled, broadcast_enabled
-            FROM customer
-            WHERE telegram_id IN ({placeholders})
+        query = _CUSTOMER_SELECT + """
+            WHERE telegram_id IN (SELECT value FROM json_each(?))
         """
-        async with self.db.execute(query, tuple(telegram_ids)) as cursor:
+        async with self.db.execute(query, (_json_ids(telegram_ids),)) as cursor:
             rows = await cursor.fetchall()
         return [_row_to_customer(row) for row in rows]
 
     async def create_batch(self, customers: Iterable[Customer]) -> None:
+        # Batch builders call isoformat inline; the per-row _to_iso frame is measurable at import sizes.
         data = [
             (
                 c.telegram_id,
-                _to_iso(c.expire_at),
+                c.expire_at.isoformat() if c.expire_at is not None else None,
                 c.language,
                 c.subscription_link,
                 c.username,
@@ -441,14 +562,13 @@ class CustomerRepository:
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(telegram_id) DO NOTHING
         """
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.executemany(query, data)
-            await self.db.commit()
 
     async def update_batch(self, customers: Iterable[Customer]) -> None:
         payload = [
             (
-                _to_iso(c.expire_at),
+                c.expire_at.isoformat() if c.expire_at is not None else None,
                 c.subscription_link,
                 c.language,
                 c.id,
@@ -462,36 +582,105 @@ class CustomerRepository:
             SET expire_at = ?, subscription_link = ?, language = ?
             WHERE id = ?
         """
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.executemany(query, payload)
-            await self.db.commit()
 
     async def delete_by_not_in_telegram_ids(self, telegram_ids: Sequence[int]) -> None:
         if telegram_ids:
-            placeholders = ",".join("?" for _ in telegram_ids)
-            query = f"DELETE FROM customer WHERE telegram_id NOT IN ({placeholders})"
-            params: Tuple[Any, ...] = tuple(telegram_ids)
+            query = "DELETE FROM customer WHERE telegram_id NOT IN (SELECT value FROM json_each(?))"
+            params: Tuple[Any, ...] = (_json_ids(telegram_ids),)
         else:
             query = "DELETE FROM customer"
             params = ()
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.execute(query, params)
-            await self.db.commit()
 
     async def delete_by_telegram_id(self, telegram_id: int) -> bool:
         query = "DELETE FROM customer WHERE telegram_id = ?"
-        async with self._lock:
+        async with write_transaction(self.db):
             cursor = await self.db.execute(query, (telegram_id,))
-            await self.db.commit()
         return bool(cursor.rowcount and cursor.rowcount > 0)
 
 
+class CachedCustomerRepository(CustomerRepository):
+    """CustomerRepository with a short-lived, size-capped read-through cache for telegram_id lookups."""
+
+    def __init__(self, db: aiosqlite.Connection, ttl_seconds: float = 30.0, maxsize: int = 10_000) -> None:
+        super().__init__(db)
+        self._ttl = ttl_seconds
+        self._maxsize = maxsize
+        # Least recently remembered first, so the cap evicts users who went quiet.
+        self._by_tg: "OrderedDict[int, Tuple[float, Customer]]" = OrderedDict()
+        self._tg_by_id: Dict[int, int] = {}
+
+    def _remember(self, customer: Customer) -> None:
+        self._by_tg[customer.telegram_id] = (time.monotonic(), replace(customer))
+        self._by_tg.move_to_end(customer.telegram_id)
+        self._tg_by_id[customer.id] = customer.telegram_id
+        while len(self._by_tg) > self._maxsize:
+            _, (_, evicted) = self._by_tg.popitem(last=False)
+            self._tg_by_id.pop(evicted.id, None)
+
+    def _forget_id(self, customer_id: int) -> None:
+        telegram_id = self._tg_by_id.pop(customer_id, None)
+        if telegram_id is not None:
+            self._by_tg.pop(telegram_id, None)
+
+    def _forget_telegram_id(self, telegram_id: int) -> None:
+        entry = self._by_tg.pop(telegram_id, None)
+        if entry is not None:
+            self._tg_by_id.pop(entry[1].id, None)
+
+    def invalidate_all(self) -> None:
+        self._by_tg.clear()
+        self._tg_by_id.clear()
+
+    async def find_by_telegram_id(self, telegram_id: int) -> Optional[Customer]:
+        entry = self._by_tg.get(telegram_id)
+        if entry is not None:
+            if time.monotonic() - entry[0] < self._ttl:
+                self._by_tg.move_to_end(telegram_id)
+                # Hand out a copy so callers mutating the customer cannot poison the cache.
+                return replace(entry[1])
+            self._forget_telegram_id(telegram_id)
+        customer = await super().find_by_telegram_id(telegram_id)
+        if customer is not None:
+            self._remember(customer)
+        return customer
+
+    async def find_or_create(self, telegram_id: int, language: str) -> Customer:
+        customer = await super().find_or_create(telegram_id, language)
+        self._remember(customer)
+        return customer
+
+    async def update_fields(self, customer_id: int, updates: Dict[str, Any]) -> None:
+        self._forget_id(customer_id)
+        await super().update_fields(customer_id, updates)
+        self._forget_id(customer_id)
+
+    async def update_batch(self, customers: Iterable[Customer]) -> None:
+        customers = list(customers)
+        for c in customers:
+            self._forget_id(c.id)
+            self._forget_telegram_id(c.telegram_id)
+        await super().update_batch(customers)
+
+    async def delete_by_not_in_telegram_ids(self, telegram_ids: Sequence[int]) -> None:
+        await super().delete_by_not_in_telegram_ids(telegram_ids)
+        self.invalidate_all()
+
+    async def delete_by_telegram_id(self, telegram_id: int) -> bool:
+        self._forget_telegram_id(telegram_id)
+        deleted = await super().delete_by_telegram_id(telegram_id)
+        self._forget_telegram_id(telegram_id)
+        return deleted
+
+
 class PurchaseRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
-    async def create(self, purchase: Purchase) -> int:
+    async def create(self, purchase: Purchase) -> Purchase:
         query = """
             INSERT INTO purchase (
                 amount, customer_id, month, currency, expire_at, status, invoice_type,
@@ -499,7 +688,8 @@ class PurchaseRepository:
                 gift_sender_telegram_id, gift_recipient_telegram_id, platega_transaction_id, platega_redirect_url
             )
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
+            RETURNING
+        """ + _PURCHASE_COLUMNS
         params = (
             purchase.amount,
             purchase.customer_id,
@@ -518,31 +708,38 @@ class PurchaseRepository:
             purchase.platega_transaction_id,
             purchase.platega_redirect_url,
         )
-        async with self._lock:
-            cursor = await self.db.execute(query, params)
-            await self.db.commit()
-        return cursor.lastrowid
+        async with write_transaction(self.db):
+            async with self.db.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+        return _row_to_purchase(row)
 
     async def find_by_invoice_type_and_status(self, invoice_type: str, status: str) -> List[Purchase]:
-        query = """
-            SELECT *
-            FROM purchase
+        query = _PURCHASE_SELECT + """
             WHERE invoice_type = ? AND status = ?
         """
         async with self.db.execute(query, (invoice_type, status)) as cursor:
             rows = await cursor.fetchall()
         return [_row_to_purchase(row) for row in rows]
 
+    async def find_by_invoice_types_and_status(self, invoice_types: Sequence[str], status: str) -> List[Purchase]:
+        """Purchases of any of ``invoice_types`` in ``status``, fetched with one query."""
+        if not invoice_types:
+            return []
+        query = _PURCHASE_SELECT + """
+            WHERE invoice_type IN (SELECT value FROM json_each(?)) AND status = ?
+        """
+        async with self.db.execute(query, (json.dumps(list(invoice_types)), status)) as cursor:
+            rows = await cursor.fetchall()
+        return [_row_to_purchase(row) for row in rows]
+
     async def find_by_id(self, purchase_id: int) -> Optional[Purchase]:
-        query = "SELECT * FROM purchase WHERE id = ?"
+        query = _PURCHASE_SELECT + " WHERE id = ?"
         async with self.db.execute(query, (purchase_id,)) as cursor:
             row = await cursor.fetchone()
         return _row_to_purchase(row) if row else None
 
     async def find_by_platega_transaction_id(self, transaction_id: str) -> Optional[Purchase]:
-        query = """
-            SELECT *
-            FROM purchase
+        query = _PURCHASE_SELECT + """
             WHERE platega_transaction_id = ?
             ORDER BY created_at DESC
             LIMIT 1
@@ -554,50 +751,75 @@ class PurchaseRepository:
     async def update_fields(self, purchase_id: int, updates: Dict[str, Any]) -> None:
         if not updates:
             return
-        fields = ", ".join(f"{key} = ?" for key in updates.keys())
-        params: List[Any] = []
-        for value in updates.values():
-            if isinstance(value, datetime):
-                params.append(_to_iso(value))
-            else:
-                params.append(value)
-        params.append(purchase_id)
-        query = f"UPDATE purchase SET {fields} WHERE id = ?"
-        async with self._lock:
-            await self.db.execute(query, tuple(params))
-            await self.db.commit()
-
-    async def mark_as_paid(self, purchase_id: int) -> None:
-        await self.update_fields(
-            purchase_id,
-            {"status": "paid", "paid_at": _to_iso(datetime.utcnow())},
-        )
+        query, params = _update_statement("purchase", purchase_id, updates)
+        async with write_transaction(self.db):
+            await self.db.execute(query, params)
+
+    async def load_processing_context(self, purchase_id: int) -> Optional[Tuple[Purchase, Optional[Customer], int]]:
+        """The purchase, its customer and the customer's count of paid purchases, in one query."""
+        query = f"""
+            SELECT
+                {_PURCHASE_CONTEXT_COLUMNS},
+                {_CUSTOMER_CONTEXT_COLUMNS},
+                (
+                    SELECT COUNT(*)
+                    FROM purchase x
+                    WHERE x.customer_id = p.customer_id
+                      AND x.status = 'paid'
+                      AND x.paid_at IS NOT NULL
+                )
+            FROM purchase p
+            LEFT JOIN customer c ON c.id = p.customer_id
+            WHERE p.id = ?
+        """
+        async with self.db.execute(query, (purchase_id,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        purchase = _row_to_purchase(row[:_PURCHASE_WIDTH])
+        customer_row = row[_PURCHASE_WIDTH:-1]
+        customer = _row_to_customer(customer_row) if customer_row[0] is not None else None
+        return purchase, customer, int(row[-1])
+
+    async def mark_as_paid(self, purchase_id: int) -> Optional[Purchase]:
+        """Mark the purchase paid and return it as stored."""
+        paid_at = datetime.utcnow()
+        query = f"UPDATE purchase SET status = 'paid', paid_at = ? WHERE id = ? RETURNING {_PURCHASE_COLUMNS}"
+        async with write_transaction(self.db):
+            async with self.db.execute(query, (_to_iso(paid_at), purchase_id)) as cursor:
+                row = await cursor.fetchone()
+            # Keep customer.first_paid_at current so new-buyer counts stay an index range scan.
+            await self.db.execute(
+                """
+                UPDATE customer
+                SET first_paid_at = COALESCE(first_paid_at, ?)
+                WHERE id = (SELECT customer_id FROM purchase WHERE id = ?)
+                """,
+                (_to_epoch(paid_at), purchase_id),
+            )
+        return _row_to_purchase(row) if row else None
 
     async def find_latest_active_tributes_by_customer_ids(self, customer_ids: Sequence[int]) -> List[Purchase]:
         if not customer_ids:
             return []
-        placeholders = ",".join("?" for _ in customer_ids)
+        # Rank before filtering on status: a customer whose latest tribute is cancelled has none active.
         query = f"""
-            SELECT p.*
-            FROM purchase p
-            JOIN (
-                SELECT customer_id, MAX(created_at) AS max_created
-                FROM purchase
-                WHERE invoice_type = 'tribute'
-                GROUP BY customer_id
-            ) latest ON latest.customer_id = p.customer_id AND latest.max_created = p.created_at
-            WHERE p.invoice_type = 'tribute'
-              AND p.status != 'cancel'
-              AND p.customer_id IN ({placeholders})
+            SELECT {_PURCHASE_COLUMNS}
+            FROM (
+                SELECT p.*, ROW_NUMBER() OVER (PARTITION BY p.customer_id ORDER BY p.created_at DESC) AS rn
+                FROM purchase p
+                WHERE p.invoice_type = 'tribute'
+                  AND p.customer_id IN (SELECT value FROM json_each(?))
+            )
+            WHERE rn = 1
+              AND status != 'cancel'
         """
-        async with self.db.execute(query, tuple(customer_ids)) as cursor:
+        async with self.db.execute(query, (_json_ids(customer_ids),)) as cursor:
             rows = await cursor.fetchall()
         return [_row_to_purchase(row) for row in rows]
 
     async def find_by_customer_id_and_invoice_type_last(self, customer_id: int, invoice_type: str) -> Optional[Purchase]:
-        query = """
-            SELECT *
-            FROM purchase
+        query = _PURCHASE_SELECT + """
             WHERE customer_id = ? AND invoice_type = ?
             ORDER BY created_at DESC
             LIMIT 1
@@ -607,9 +829,7 @@ class PurchaseRepository:
         return _row_to_purchase(row) if row else None
 
     async def find_successful_paid_purchase_by_customer(self, customer_id: int) -> Optional[Purchase]:
-        query = """
-            SELECT *
-            FROM purchase
+        query = _PURCHASE_SELECT + """
             WHERE customer_id = ?
               AND status = 'paid'
               AND invoice_type IN ('crypto', 'yookasa', 'platega')
@@ -620,57 +840,38 @@ class PurchaseRepository:
             row = await cursor.fetchone()
         return _row_to_purchase(row) if row else None
 
-    async def count_paid_by_customer(self, customer_id: int) -> int:
-        query = """
-            SELECT COUNT(*)
-            FROM purchase
-            WHERE customer_id = ?
-              AND status = 'paid'
-              AND paid_at IS NOT NULL
-        """
-        async with self.db.execute(query, (customer_id,)) as cursor:
-            row = await cursor.fetchone()
-        return int(row[0]) if row else 0
-
-    async def count_paid_in_period(self, start_utc: datetime, end_utc: datetime) -> int:
+    async def paid_stats_in_period(self, start_utc: datetime, end_utc: datetime) -> Tuple[int, float]:
+        """Count and revenue of paid purchases in one pass over the period."""
         query = """
-            SELECT COUNT(*)
+            SELECT COUNT(*), COALESCE(SUM(amount), 0)
             FROM purchase
             WHERE status = 'paid'
               AND paid_at IS NOT NULL
               AND paid_at >= ?
               AND paid_at < ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
+        async with acquire_reader() as db, db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
             row = await cursor.fetchone()
-        return int(row[0]) if row else 0
+        if not row:
+            return 0, 0.0
+        return int(row[0]), float(row[1] or 0)
+
+    async def count_paid_in_period(self, start_utc: datetime, end_utc: datetime) -> int:
+        count, _ = await self.paid_stats_in_period(start_utc, end_utc)
+        return count
 
     async def revenue_paid_in_period(self, start_utc: datetime, end_utc: datetime) -> float:
-        query = """
-            SELECT COALESCE(SUM(amount), 0)
-            FROM purchase
-            WHERE status = 'paid'
-              AND paid_at IS NOT NULL
-              AND paid_at >= ?
-              AND paid_at < ?
-        """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
-            row = await cursor.fetchone()
-        return float(row[0]) if row and row[0] is not None else 0.0
+        _, revenue = await self.paid_stats_in_period(start_utc, end_utc)
+        return revenue
 
     async def count_new_paid_customers_in_period(self, start_utc: datetime, end_utc: datetime) -> int:
         query = """
-            WITH first_paid AS (
-                SELECT customer_id, MIN(paid_at) AS first_paid_at
-                FROM purchase
-                WHERE status = 'paid' AND paid_at IS NOT NULL
-                GROUP BY customer_id
-            )
             SELECT COUNT(*)
-            FROM first_paid
-            WHERE first_paid_at >= ? AND first_paid_at < ?
+            FROM customer
+            WHERE first_paid_at >= ?
+              AND first_paid_at < ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
+        async with acquire_reader() as db, db.execute(query, (_to_epoch(start_utc), _to_epoch(end_utc))) as cursor:
             row = await cursor.fetchone()
         return int(row[0]) if row else 0
 
@@ -678,7 +879,6 @@ class PurchaseRepository:
 class ReferralRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def create(self, referrer_id: int, referee_id: int) -> Referral:
         existing_referee = await self.find_by_referee(referee_id)
@@ -688,13 +888,12 @@ class ReferralRepository:
             INSERT INTO referral (referrer_id, referee_id, used_at, bonus_granted)
             VALUES (?, ?, CURRENT_TIMESTAMP, 0)
         """
-        async with self._lock:
-            try:
+        try:
+            async with write_transaction(self.db):
                 cursor = await self.db.execute(query, (referrer_id, referee_id))
-                await self.db.commit()
-                new_id = cursor.lastrowid
-            except sqlite3.IntegrityError:
-                return await self.find_by_pair(referrer_id, referee_id)
+        except sqlite3.IntegrityError:
+            return await self.find_by_pair(referrer_id, referee_id)
+        new_id = cursor.lastrowid
         return Referral(
             id=new_id,
             referrer_id=referrer_id,
@@ -744,8 +943,7 @@ class ReferralRepository:
         details: List[ReferralDetails] = []
         for row in rows:
             ref = _row_to_referral(row)
-            username = row["referee_username"] if "referee_username" in row.keys() else None
-            details.append(ReferralDetails(referral=ref, referee_username=username))
+            details.append(ReferralDetails(referral=ref, referee_username=row["referee_username"]))
         return details
 
     async def find_by_referee(self, referee_id: int) -> Optional[Referral]:
@@ -761,24 +959,25 @@ class ReferralRepository:
 
     async def mark_bonus_granted(self, referral_id: int) -> None:
         query = "UPDATE referral SET bonus_granted = 1 WHERE id = ?"
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.execute(query, (referral_id,))
-            await self.db.commit()
+
+
+# A generated code colliding this many times in a row means the IntegrityError is something else.
+_PROMO_CODE_ATTEMPTS = 5
 
 
 class PromoRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def create(self, code: str, days: int, traffic_gb: int, max_uses: int, created_by: Optional[int]) -> PromoCode:
         query = """
             INSERT INTO promo_code (code, days, traffic_gb, max_uses, used, created_by)
             VALUES (?, ?, ?, ?, 0, ?)
         """
-        async with self._lock:
+        async with write_transaction(self.db):
             cursor = await self.db.execute(query, (code, days, traffic_gb, max_uses, created_by))
-            await self.db.commit()
             promo_id = cursor.lastrowid
         return PromoCode(
             id=promo_id,
@@ -791,6 +990,22 @@ class PromoRepository:
             created_by=created_by,
         )
 
+    async def create_unique(
+        self,
+        make_code: Callable[[], str],
+        days: int,
+        traffic_gb: int,
+        max_uses: int,
+        created_by: Optional[int],
+    ) -> PromoCode:
+        # UNIQUE(code) catches the rare collision, so no lookup is needed before the insert.
+        for _ in range(_PROMO_CODE_ATTEMPTS - 1):
+            try:
+                return await self.create(make_code(), days, traffic_gb, max_uses, created_by)
+            except sqlite3.IntegrityError:
+                continue
+        return await self.create(make_code(), days, traffic_gb, max_uses, created_by)
+
     async def list_all(self, limit: int = 30) -> List[PromoCode]:
         query = """
             SELECT id, code, days, traffic_gb, max_uses, used, created_at, created_by
@@ -798,8 +1013,8 @@ class PromoRepository:
             ORDER BY created_at DESC
             LIMIT ?
         """
-        async with self.db.execute(query, (limit,)) as cursor:
-            rows = await cursor.fetchall()
+        async with acquire_reader() as db:
+            rows = await db.execute_fetchall(query, (limit,))
         return [_row_to_promocode(row) for row in rows]
 
     async def find_by_code(self, code: str) -> Optional[PromoCode]:
@@ -812,61 +1027,45 @@ class PromoRepository:
             row = await cursor.fetchone()
         return _row_to_promocode(row) if row else None
 
-    async def _find_redemption(self, promo_id: int, customer_id: int) -> Optional[PromoRedemption]:
-        query = """
-            SELECT id, promo_id, customer_id, used_at
-            FROM promo_redemption
-            WHERE promo_id = ? AND customer_id = ?
-            LIMIT 1
-        """
-        async with self.db.execute(query, (promo_id, customer_id)) as cursor:
-            row = await cursor.fetchone()
-        return _row_to_promo_redemption(row) if row else None
-
     async def redeem(self, promo: PromoCode, customer_id: int) -> str:
         """
         Try to redeem promo for customer.
         Returns status: 'ok', 'exhausted', 'already_used'
         """
-        async with self._lock:
-            existing = await self._find_redemption(promo.id, customer_id)
-            if existing:
-                return "already_used"
-            async with self.db.execute(
-                "SELECT used, max_uses FROM promo_code WHERE id = ?", (promo.id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-            if not row:
-                return "exhausted"
-            used, max_uses = row
-            if used >= max_uses:
-                return "exhausted"
-            await self.db.execute("UPDATE promo_code SET used = used + 1 WHERE id = ?", (promo.id,))
-            await self.db.execute(
-                "INSERT INTO promo_redemption (promo_id, customer_id) VALUES (?, ?)",
-                (promo.id, customer_id),
-            )
-            await self.db.commit()
-            return "ok"
+        claim = """
+            UPDATE promo_code SET used = used + 1
+            WHERE id = ? AND used < max_uses
+              AND NOT EXISTS (SELECT 1 FROM promo_redemption WHERE promo_id = ? AND customer_id = ?)
+        """
+        async with write_transaction(self.db):
+            cursor = await self.db.execute(claim, (promo.id, promo.id, customer_id))
+            if cursor.rowcount:
+                await self.db.execute(
+                    "INSERT OR IGNORE INTO promo_redemption (promo_id, customer_id) VALUES (?, ?)",
+                    (promo.id, customer_id),
+                )
+                return "ok"
+        async with self.db.execute(
+            "SELECT 1 FROM promo_redemption WHERE promo_id = ? AND customer_id = ?", (promo.id, customer_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return "already_used" if row else "exhausted"
 
 
 class SalesRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def record_sale(self, purchase: Purchase, customer: Customer, is_new_customer: bool) -> None:
         paid_at = purchase.paid_at or datetime.utcnow()
         currency = (purchase.currency or "").upper()
         amount_rub = float(purchase.amount)
-        if currency in {"STARS", "XTR"}:
-            amount_rub = float(purchase.amount)
         query = """
             INSERT INTO sales_log (
                 purchase_id, customer_id, telegram_id, amount, currency, amount_rub,
-                invoice_type, plan, is_new_customer, paid_at
+                invoice_type, plan, is_new_customer, paid_at, paid_at_ts, is_stars, amount_rub_kopecks
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(purchase_id) DO UPDATE SET
                 customer_id = excluded.customer_id,
                 telegram_id = excluded.telegram_id,
@@ -876,7 +1075,10 @@ class SalesRepository:
                 invoice_type = excluded.invoice_type,
                 plan = excluded.plan,
                 is_new_customer = excluded.is_new_customer,
-                paid_at = excluded.paid_at
+                paid_at = excluded.paid_at,
+                paid_at_ts = excluded.paid_at_ts,
+                is_stars = excluded.is_stars,
+                amount_rub_kopecks = excluded.amount_rub_kopecks
         """
         params = (
             purchase.id,
@@ -889,48 +1091,53 @@ class SalesRepository:
             purchase.plan,
             1 if is_new_customer else 0,
             _to_iso(paid_at),
+            _to_epoch(paid_at),
+            1 if currency in {"STARS", "XTR"} else 0,
+            int(round(amount_rub * 100)),
         )
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.execute(query, params)
-            await self.db.commit()
 
-    async def count_paid_in_period(self, start_utc: datetime, end_utc: datetime) -> int:
+    async def paid_counts_in_period(self, start_utc: datetime, end_utc: datetime) -> Tuple[int, int]:
+        """Number of sales and of first-time buyers in the period, from a single scan."""
         query = """
-            SELECT COUNT(*)
+            SELECT COUNT(*), COALESCE(SUM(is_new_customer = 1), 0)
             FROM sales_log
-            WHERE paid_at >= ?
-              AND paid_at < ?
+            WHERE paid_at_ts >= ?
+              AND paid_at_ts < ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
-            row = await cursor.fetchone()
-        return int(row[0]) if row else 0
+        async with acquire_reader() as db:
+            row = _first_row(await db.execute_fetchall(query, (_to_epoch(start_utc), _to_epoch(end_utc))))
+        if not row:
+            return 0, 0
+        return int(row[0]), int(row[1])
 
     async def count_new_paid_customers_in_period(self, start_utc: datetime, end_utc: datetime) -> int:
         query = """
             SELECT COUNT(*)
             FROM sales_log
-            WHERE paid_at >= ?
-              AND paid_at < ?
+            WHERE paid_at_ts >= ?
+              AND paid_at_ts < ?
               AND is_new_customer = 1
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
-            row = await cursor.fetchone()
+        async with acquire_reader() as db:
+            row = _first_row(await db.execute_fetchall(query, (_to_epoch(start_utc), _to_epoch(end_utc))))
         return int(row[0]) if row else 0
 
     async def finance_totals_in_period(self, start_utc: datetime, end_utc: datetime) -> Dict[str, float]:
         query = """
             SELECT
                 COUNT(*) AS sales_count,
-                COALESCE(SUM(amount_rub), 0) AS revenue_rub,
-                COALESCE(SUM(CASE WHEN UPPER(COALESCE(currency, '')) IN ('STARS', 'XTR') THEN amount ELSE 0 END), 0) AS stars_amount,
-                COALESCE(SUM(CASE WHEN UPPER(COALESCE(currency, '')) IN ('STARS', 'XTR') THEN amount_rub ELSE 0 END), 0) AS stars_revenue_rub,
-                COALESCE(SUM(CASE WHEN UPPER(COALESCE(currency, '')) NOT IN ('STARS', 'XTR') THEN amount_rub ELSE 0 END), 0) AS fiat_revenue_rub
+                COALESCE(SUM(amount_rub_kopecks), 0) AS revenue_kopecks,
+                COALESCE(SUM(CASE WHEN is_stars = 1 THEN amount ELSE 0 END), 0) AS stars_amount,
+                COALESCE(SUM(CASE WHEN is_stars = 1 THEN amount_rub_kopecks ELSE 0 END), 0) AS stars_revenue_kopecks,
+                COALESCE(SUM(CASE WHEN is_stars = 0 THEN amount_rub_kopecks ELSE 0 END), 0) AS fiat_revenue_kopecks
             FROM sales_log
-            WHERE paid_at >= ?
-              AND paid_at < ?
+            WHERE paid_at_ts >= ?
+              AND paid_at_ts < ?
         """
-        async with self.db.execute(query, (_to_iso(start_utc), _to_iso(end_utc))) as cursor:
-            row = await cursor.fetchone()
+        async with acquire_reader() as db:
+            row = _first_row(await db.execute_fetchall(query, (_to_epoch(start_utc), _to_epoch(end_utc))))
         if not row:
             return {
                 "sales_count": 0.0,
@@ -941,52 +1148,58 @@ class SalesRepository:
             }
         return {
             "sales_count": float(row["sales_count"] or 0),
-            "revenue_rub": float(row["revenue_rub"] or 0),
+            # Sums stay integer kopecks in SQLite; convert to roubles only here.
+            "revenue_rub": (row["revenue_kopecks"] or 0) / 100,
             "stars_amount": float(row["stars_amount"] or 0),
-            "stars_revenue_rub": float(row["stars_revenue_rub"] or 0),
-            "fiat_revenue_rub": float(row["fiat_revenue_rub"] or 0),
+            "stars_revenue_rub": (row["stars_revenue_kopecks"] or 0) / 100,
+            "fiat_revenue_rub": (row["fiat_revenue_kopecks"] or 0) / 100,
         }
 
     async def list_recent(self, limit: int = 30) -> List[SaleLog]:
-        query = """
-            SELECT *
+        query = f"""
+            SELECT {_SALE_LOG_COLUMNS}
             FROM sales_log
-            ORDER BY paid_at DESC
+            ORDER BY paid_at_ts DESC
             LIMIT ?
         """
-        async with self.db.execute(query, (limit,)) as cursor:
-            rows = await cursor.fetchall()
+        async with acquire_reader() as db:
+            rows = await db.execute_fetchall(query, (limit,))
         return [_row_to_sale_log(row) for row in rows]
 
 
 class PriceSettingRepository:
-    def __init__(self, db: aiosqlite.Connection) -> None:
+    def __init__(self, db: aiosqlite.Connection, ttl_seconds: float = 60.0) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
+        # Prices change only through this repository, so a short TTL is just a guard against
+        # edits made to the database by hand.
+        self._ttl = ttl_seconds
+        self._cached: Optional[Tuple[float, List[PriceSetting]]] = None
 
-    async def ensure_defaults(self, defaults: Dict[str, int]) -> None:
+    async def ensure_defaults(self, defaults: Mapping[str, int]) -> None:
         if not defaults:
             return
-        async with self._lock:
-            for key, value in defaults.items():
-                await self.db.execute(
-                    """
-                    INSERT OR IGNORE INTO price_setting (key, value, updated_at, updated_by)
-                    VALUES (?, ?, CURRENT_TIMESTAMP, NULL)
-                    """,
-                    (key, int(value)),
-                )
-            await self.db.commit()
+        query = """
+            INSERT OR IGNORE INTO price_setting (key, value, updated_at, updated_by)
+            VALUES (?, ?, CURRENT_TIMESTAMP, NULL)
+        """
+        async with write_transaction(self.db):
+            await self.db.executemany(query, [(key, int(value)) for key, value in defaults.items()])
+        self._cached = None
 
     async def list_all(self) -> List[PriceSetting]:
+        cached = self._cached
+        if cached is not None and time.monotonic() - cached[0] < self._ttl:
+            return [replace(item) for item in cached[1]]
         query = """
             SELECT key, value, updated_at, updated_by
             FROM price_setting
             ORDER BY key ASC
         """
-        async with self.db.execute(query) as cursor:
-            rows = await cursor.fetchall()
-        return [_row_to_price_setting(row) for row in rows]
+        async with acquire_reader() as db:
+            rows = await db.execute_fetchall(query)
+        settings = [_row_to_price_setting(row) for row in rows]
+        self._cached = (time.monotonic(), settings)
+        return [replace(item) for item in settings]
 
     async def get_all_map(self) -> Dict[str, int]:
         settings = await self.list_all()
@@ -1001,28 +1214,17 @@ class PriceSettingRepository:
                 updated_at = CURRENT_TIMESTAMP,
                 updated_by = excluded.updated_by
         """
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.execute(query, (key, int(value), updated_by))
-            await self.db.commit()
+        self._cached = None
 
     async def get_value(self, key: str) -> Optional[int]:
-        query = """
-            SELECT key, value, updated_at, updated_by
-            FROM price_setting
-            WHERE key = ?
-            LIMIT 1
-        """
-        async with self.db.execute(query, (key,)) as cursor:
-            row = await cursor.fetchone()
-        if not row:
-            return None
-        return int(row["value"])
+        return (await self.get_all_map()).get(key)
 
 
 class GiftNotificationRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def create(
         self,
@@ -1047,56 +1249,54 @@ class GiftNotificationRepository:
             message,
             purchase_id,
         )
-        async with self._lock:
-            cursor = await self.db.execute(query, params)
-            await self.db.commit()
-        return int(cursor.lastrowid)
+        async with write_transaction(self.db):
+            row = await self.db.execute_insert(query, params)
+        return int(row[0])
 
     async def list_pending_by_recipient(self, recipient_telegram_id: int, limit: int = 10) -> List[GiftNotification]:
-        query = """
-            SELECT *
+        query = f"""
+            SELECT {_GIFT_NOTIFICATION_COLUMNS}
             FROM gift_notification
             WHERE recipient_telegram_id = ?
               AND delivered = 0
             ORDER BY created_at ASC
             LIMIT ?
         """
-        async with self.db.execute(query, (int(recipient_telegram_id), limit)) as cursor:
-            rows = await cursor.fetchall()
+        async with acquire_reader() as db:
+            rows = await db.execute_fetchall(query, (int(recipient_telegram_id), limit))
         return [_row_to_gift_notification(row) for row in rows]
 
     async def mark_delivered(self, notification_ids: Sequence[int]) -> None:
         if not notification_ids:
             return
-        placeholders = ",".join("?" for _ in notification_ids)
-        query = f"""
+        query = """
             UPDATE gift_notification
             SET delivered = 1,
                 delivered_at = CURRENT_TIMESTAMP
-            WHERE id IN ({placeholders})
+            WHERE id IN (SELECT value FROM json_each(?))
         """
-        async with self._lock:
-            await self.db.execute(query, tuple(int(x) for x in notification_ids))
-            await self.db.commit()
+        async with write_transaction(self.db):
+            await self.db.execute(query, (_json_ids(notification_ids),))
 
 
 class DuoPurchaseMemberRepository:
     def __init__(self, db: aiosqlite.Connection) -> None:
         self.db = db
-        self._lock = asyncio.Lock()
 
     async def replace_members(self, purchase_id: int, member_telegram_ids: Sequence[int]) -> None:
+        seen: Set[int] = set()
         unique_ids: List[int] = []
         for raw in member_telegram_ids:
             try:
                 value = int(raw)
             except Exception:
                 continue
-            if value <= 0 or value in unique_ids:
+            if value <= 0 or value in seen:
                 continue
+            seen.add(value)
             unique_ids.append(value)
 
-        async with self._lock:
+        async with write_transaction(self.db):
             await self.db.execute("DELETE FROM duo_purchase_member WHERE purchase_id = ?", (int(purchase_id),))
             if unique_ids:
                 await self.db.executemany(
@@ -1106,7 +1306,6 @@ class DuoPurchaseMemberRepository:
                     """,
                     [(int(purchase_id), member_id) for member_id in unique_ids],
                 )
-            await self.db.commit()
 
     async def list_member_ids(self, purchase_id: int) -> List[int]:
         query = """
@@ -1115,6 +1314,6 @@ class DuoPurchaseMemberRepository:
             WHERE purchase_id = ?
             ORDER BY id ASC
         """
-        async with self.db.execute(query, (int(purchase_id),)) as cursor:
-            rows = await cursor.fetchall()
-        return [int(row["member_telegram_id"]) for row in rows]
+        async with acquire_reader() as db:
+            rows = await db.execute_fetchall(query, (int(purchase_id),))
+        return _int_column(rows)
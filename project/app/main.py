@@ -2,7 +2,8 @@ import asyncio
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
 from zoneinfo import ZoneInfo
 
 import aiohttp
@@ -12,14 +13,15 @@ from aiohttp import web
 
 from .bot.routers.main import setup_router
 from .config import config
-from .db.connection import close_db, init_db
+from .db.connection import close_db, init_db, write_lock
 from .db.migrations import run_migrations
 from .db.queries import (
-    CustomerRepository,
+    CachedCustomerRepository,
     DuoPurchaseMemberRepository,
     GiftNotificationRepository,
     PriceSettingRepository,
     PromoRepository,
+    Purchase,
     PurchaseRepository,
     ReferralRepository,
     SalesRepository,
@@ -54,12 +56,12 @@ PRICE_SETTING_KEYS = (
 )
 
 
-def _price_defaults_from_config() -> dict[str, int]:
-    return {key: int(getattr(config, key)) for key in PRICE_SETTING_KEYS}
+# Env-configured prices, captured before _apply_prices_from_db overwrites config with stored values.
+_PRICE_DEFAULTS: Mapping[str, int] = MappingProxyType({key: int(getattr(config, key)) for key in PRICE_SETTING_KEYS})
 
 
 async def _apply_prices_from_db(price_repo: PriceSettingRepository) -> None:
-    await price_repo.ensure_defaults(_price_defaults_from_config())
+    await price_repo.ensure_defaults(_PRICE_DEFAULTS)
     db_prices = await price_repo.get_all_map()
     for key, value in db_prices.items():
         if hasattr(config, key):
@@ -103,82 +105,122 @@ async def start_health_server(
     return runner
 
 
-async def crypto_checker(
+async def _check_crypto(
+    pending: List[Purchase], crypto_client: CryptoPayClient, payment_service: PaymentService
+) -> None:
+    invoice_ids = [str(p.crypto_invoice_id) for p in pending if p.crypto_invoice_id]
+    if not invoice_ids:
+        return
+    invoices = await crypto_client.get_invoices(invoice_ids=",".join(invoice_ids))
+    for invoice in invoices:
+        status = invoice.get("status")
+        if status and status.lower() == "paid":
+            payload = invoice.get("payload", "")
+            parts = payload.split("&")
+            purchase_id = int(parts[0].split("=")[1])
+            username = parts[1].split("=")[1] if len(parts) > 1 and "=" in parts[1] else None
+            await payment_service.process_purchase_by_id(purchase_id, username=username)
+
+
+async def _check_yookassa(
+    pending: List[Purchase], yookassa_client: YookassaClient, payment_service: PaymentService
+) -> None:
+    pending = [p for p in pending if p.yookasa_id]
+    invoices = await asyncio.gather(
+        *(yookassa_client.get_payment(p.yookasa_id) for p in pending), return_exceptions=True
+    )
+    for purchase, invoice in zip(pending, invoices):
+        if isinstance(invoice, Exception):
+            logger.warning("yookassa payment %s check failed: %s", purchase.yookasa_id, invoice)
+            continue
+        if invoice.get("status") == "canceled":
+            await payment_service.cancel_yookassa_payment(purchase.id)
+            continue
+        if invoice.get("paid"):
+            metadata = invoice.get("metadata", {})
+            purchase_id = int(metadata.get("purchaseId") or purchase.id)
+            username = metadata.get("username")
+            await payment_service.process_purchase_by_id(purchase_id, username=username)
+
+
+async def _check_platega(
+    pending: List[Purchase], platega_client: PlategaClient, payment_service: PaymentService
+) -> None:
+    pending = [p for p in pending if p.platega_transaction_id]
+    invoices = await asyncio.gather(
+        *(platega_client.get_transaction(p.platega_transaction_id) for p in pending), return_exceptions=True
+    )
+    for purchase, invoice in zip(pending, invoices):
+        if isinstance(invoice, Exception):
+            logger.warning("platega transaction %s check failed: %s", purchase.platega_transaction_id, invoice)
+            continue
+        status = (invoice.get("status") or "").upper()
+        if status == "CANCELED":
+            await payment_service.cancel_platega_payment(purchase.id)
+            continue
+        if status == "CONFIRMED":
+            await payment_service.process_purchase_by_id(purchase.id, username=None)
+
+
+async def payment_checker(
     purchase_repo: PurchaseRepository,
-    crypto_client: CryptoPayClient,
     payment_service: PaymentService,
+    crypto_client: Optional[CryptoPayClient],
+    yookassa_client: Optional[YookassaClient],
+    platega_client: Optional[PlategaClient],
 ):
-    while True:
-        try:
-            pending = await purchase_repo.find_by_invoice_type_and_status("crypto", "pending")
-            invoice_ids = [str(p.crypto_invoice_id) for p in pending if p.crypto_invoice_id]
-            if invoice_ids:
-                invoices = await crypto_client.get_invoices(invoice_ids=",".join(invoice_ids))
-                for invoice in invoices:
-                    status = invoice.get("status")
-                    if status and status.lower() == "paid":
-                        payload = invoice.get("payload", "")
-                        parts = payload.split("&")
-                        purchase_id = int(parts[0].split("=")[1])
-                        username = parts[1].split("=")[1] if len(parts) > 1 and "=" in parts[1] else None
-                        await payment_service.process_purchase_by_id(purchase_id, username=username)
-        except asyncio.CancelledError:
-            raise
-        except Exception as err:  # noqa: BLE001
-            logger.exception("crypto checker error: %s", err)
-        await asyncio.sleep(5)
+    """Poll every enabled provider from one loop, reading all pending invoices in a single query.
 
+    Platega keeps its slower 10s cadence by being checked on every other 5s tick. With nothing
+    pending the loop parks until PaymentService announces a new invoice (or a minute passes).
+    """
+    checks = []
+    if crypto_client:
+        checks.append(("crypto", 1, crypto_client, _check_crypto))
+    if yookassa_client:
+        checks.append(("yookasa", 1, yookassa_client, _check_yookassa))
+    if platega_client:
+        checks.append(("platega", 2, platega_client, _check_platega))
+    if not checks:
+        return
 
-async def yookassa_checker(
-    purchase_repo: PurchaseRepository,
-    yookassa_client: YookassaClient,
-    payment_service: PaymentService,
-):
+    tick = 0
     while True:
+        due = [check for check in checks if tick % check[1] == 0]
+        tick += 1
+        idle = False
         try:
-            pending = await purchase_repo.find_by_invoice_type_and_status("yookasa", "pending")
+            pending = await purchase_repo.find_by_invoice_types_and_status(
+                [invoice_type for invoice_type, _, _, _ in due], "pending"
+            )
+            idle = not pending and len(due) == len(checks)
+            by_type: Dict[str, List[Purchase]] = {invoice_type: [] for invoice_type, _, _, _ in due}
             for purchase in pending:
-                if not purchase.yookasa_id:
-                    continue
-                invoice = await yookassa_client.get_payment(purchase.yookasa_id)
-                if invoice.get("status") == "canceled":
-                    await payment_service.cancel_yookassa_payment(purchase.id)
-                    continue
-                if invoice.get("paid"):
-                    metadata = invoice.get("metadata", {})
-                    purchase_id = int(metadata.get("purchaseId") or purchase.id)
-                    username = metadata.get("username")
-                    await payment_service.process_purchase_by_id(purchase_id, username=username)
+                by_type[purchase.invoice_type].append(purchase)
+            results = await asyncio.gather(
+                *(
+                    check(by_type[invoice_type], client, payment_service)
+                    for invoice_type, _, client, check in due
+                    if by_type[invoice_type]
+                ),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error("payment checker error: %s", result, exc_info=result)
         except asyncio.CancelledError:
             raise
         except Exception as err:  # noqa: BLE001
-            logger.exception("yookassa checker error: %s", err)
-        await asyncio.sleep(5)
-
-
-async def platega_checker(
-    purchase_repo: PurchaseRepository,
-    platega_client: PlategaClient,
-    payment_service: PaymentService,
-):
-    while True:
+            logger.exception("payment checker error: %s", err)
+        if not idle:
+            await asyncio.sleep(5)
+            continue
         try:
-            pending = await purchase_repo.find_by_invoice_type_and_status("platega", "pending")
-            for purchase in pending:
-                if not purchase.platega_transaction_id:
-                    continue
-                invoice = await platega_client.get_transaction(purchase.platega_transaction_id)
-                status = (invoice.get("status") or "").upper()
-                if status == "CANCELED":
-                    await payment_service.cancel_platega_payment(purchase.id)
-                    continue
-                if status == "CONFIRMED":
-                    await payment_service.process_purchase_by_id(purchase.id, username=None)
-        except asyncio.CancelledError:
-            raise
-        except Exception as err:  # noqa: BLE001
-            logger.exception("platega checker error: %s", err)
-        await asyncio.sleep(10)
+            await asyncio.wait_for(payment_service.invoice_created.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
+        payment_service.invoice_created.clear()
+        tick = 0
 
 
 async def subscription_checker(subscription_service: SubscriptionService):
@@ -196,6 +238,20 @@ async def subscription_checker(subscription_service: SubscriptionService):
             logger.exception("subscription checker error: %s", err)
 
 
+async def wal_checkpoint_task(db) -> None:
+    """Truncate the WAL every few minutes so bursts never leave a large log to checkpoint inline."""
+    while True:
+        await asyncio.sleep(300)
+        try:
+            # Writers commit or roll back before releasing the lock, so no transaction is open here.
+            async with write_lock(db):
+                await db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:  # noqa: BLE001
+            logger.exception("wal checkpoint error: %s", err)
+
+
 async def daily_report_checker(stats_service: StatsService, report_type: str, hour_local: int) -> None:
     hour = max(0, min(23, int(hour_local)))
     while True:
@@ -231,16 +287,20 @@ async def main() -> None:
     tm = TranslationManager(default_language=config.default_language)
     tm.load(translations_path)
 
-    db = await init_db(config.db_path)
+    db = await init_db(config.db_path, synchronous=config.db_synchronous)
     await run_migrations(db)
 
-    session = aiohttp.ClientSession()
+    # One session for every provider client: keep-alive sockets and cached DNS survive between polls.
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=75)
+    session = aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=300, sock_connect=10)
+    )
 
     bot = Bot(token=config.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
     me = await bot.get_me()
     config.bot_url = f"https://t.me/{me.username}"
 
-    customer_repo = CustomerRepository(db)
+    customer_repo = CachedCustomerRepository(db)
     purchase_repo = PurchaseRepository(db)
     referral_repo = ReferralRepository(db)
     promo_repo = PromoRepository(db)
@@ -321,13 +381,14 @@ async def main() -> None:
     health_runner = await start_health_server(remnawave_client, db, tribute_handler, platega_handler)
 
     tasks = []
-    if crypto_client:
-        tasks.append(asyncio.create_task(crypto_checker(purchase_repo, crypto_client, payment_service)))
-    if yookassa_client:
-        tasks.append(asyncio.create_task(yookassa_checker(purchase_repo, yookassa_client, payment_service)))
-    if platega_client:
-        tasks.append(asyncio.create_task(platega_checker(purchase_repo, platega_client, payment_service)))
+    if crypto_client or yookassa_client or platega_client:
+        tasks.append(
+            asyncio.create_task(
+                payment_checker(purchase_repo, payment_service, crypto_client, yookassa_client, platega_client)
+            )
+        )
     tasks.append(asyncio.create_task(subscription_checker(subscription_service)))
+    tasks.append(asyncio.create_task(wal_checkpoint_task(db)))
     tasks.append(
         asyncio.create_task(
             daily_report_checker(stats_service, "traffic", config.daily_traffic_report_hour)
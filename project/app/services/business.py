@@ -69,40 +69,35 @@ class PaymentService:
         self.duo_member_repo = duo_member_repo
         self.cache = cache
         self.moynalog_client = moynalog_client
-
-    def _button_emoji_id(self, lang: str, key: str) -> Optional[str]:
-        value = self.translation.get_text(lang, f"{key}_emoji_id")
-        if not value or value == f"{key}_emoji_id":
-            return None
-        return value
+        # Set whenever a polled (crypto/yookasa/platega) invoice turns pending; wakes the payment checker.
+        self.invoice_created = asyncio.Event()
+        self._connect_markups: Dict[str, InlineKeyboardMarkup] = {}
 
     async def process_purchase_by_id(self, purchase_id: int, username: Optional[str]) -> None:
-        purchase = await self.purchase_repo.find_by_id(purchase_id)
-        if not purchase:
+        context, message_id = await asyncio.gather(
+            self.purchase_repo.load_processing_context(purchase_id),
+            self.cache.get(purchase_id),
+        )
+        if not context:
             raise RuntimeError(f"purchase {purchase_id} not found")
+        purchase, customer, prior_paid_count = context
         if purchase.status == "paid":
             logger.info("purchase already processed id=%s", purchase_id)
             return
 
-        customer = await self.customer_repo.find_by_id(purchase.customer_id)
         if not customer:
             raise RuntimeError(f"customer {purchase.customer_id} not found")
         previous_expire_at = customer.expire_at
         is_renewal = bool(previous_expire_at and previous_expire_at > datetime.utcnow())
-        prior_paid_count = await self.purchase_repo.count_paid_by_customer(customer.id)
-
-        message_id = await self.cache.get(purchase.id)
-        if message_id:
-            try:
-                await self.bot.delete_message(customer.telegram_id, message_id)
-            except Exception as err:  # noqa: BLE001
-                logger.warning("failed to delete payment message: %s", err)
 
         plan = purchase.plan or "standard"
         gift_sender_id = purchase.gift_sender_telegram_id
         gift_recipient_id = purchase.gift_recipient_telegram_id
         is_gift = bool(gift_sender_id and gift_recipient_id)
-        user = await self.remnawave_client.fetch_user_by_telegram(customer.telegram_id)
+        user, _ = await asyncio.gather(
+            self.remnawave_client.fetch_user_by_telegram(customer.telegram_id),
+            self._delete_payment_message(customer.telegram_id, message_id),
+        )
 
         days = purchase.month * config.days_in_month
         traffic_limit_bytes = config.traffic_limit_bytes
@@ -137,8 +132,7 @@ class PaymentService:
             except Exception as err:  # noqa: BLE001
                 logger.warning("failed to reset traffic for renewal customer=%s: %s", customer.telegram_id, err)
 
-        await self.purchase_repo.mark_as_paid(purchase.id)
-        refreshed_purchase = await self.purchase_repo.find_by_id(purchase.id)
+        refreshed_purchase = await self.purchase_repo.mark_as_paid(purchase.id)
         if refreshed_purchase:
             purchase = refreshed_purchase
         await self.sales_repo.record_sale(
@@ -163,7 +157,7 @@ class PaymentService:
             await self.bot.send_message(
                 customer.telegram_id,
                 text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=self._connect_keyboard(customer.language)),
+                reply_markup=self._connect_markup(customer.language),
             )
             recipient_notified = True
         except Exception as err:  # noqa: BLE001
@@ -201,15 +195,24 @@ class PaymentService:
         await self._notify_owner_about_purchase(customer, purchase, plan, previous_expire_at, user.expire_at)
         logger.info("purchase processed id=%s type=%s", purchase.id, purchase.invoice_type)
 
+    async def _delete_payment_message(self, telegram_id: int, message_id: Optional[int]) -> None:
+        if not message_id:
+            return
+        try:
+            await self.bot.delete_message(telegram_id, message_id)
+        except Exception as err:  # noqa: BLE001
+            logger.warning("failed to delete payment message: %s", err)
+
     async def _notify_duo_members(self, purchase: Purchase, buyer: Customer, subscription_url: str) -> None:
         member_ids = await self.duo_member_repo.list_member_ids(purchase.id)
         if not member_ids:
             return
-        member_ids = member_ids[:1]
+        member_ids = [member_id for member_id in member_ids[:1] if member_id != buyer.telegram_id]
+        if not member_ids:
+            return
+        customers = {c.telegram_id: c for c in await self.customer_repo.find_by_telegram_ids(member_ids)}
         for member_id in member_ids:
-            if member_id == buyer.telegram_id:
-                continue
-            member_customer = await self.customer_repo.find_by_telegram_id(member_id)
+            member_customer = customers.get(member_id)
             if not member_customer:
                 try:
                     await self.bot.send_message(
@@ -222,11 +225,14 @@ class PaymentService:
                 continue
 
             member_lang = member_customer.language or config.default_language
+            texts = self.translation.get_many(
+                member_lang, ("duo_member_notification_title", "connect_instructions", "subscription_link")
+            )
             notify_text = "\n\n".join(
                 [
-                    self.translation.get_text(member_lang, "duo_member_notification_title") % buyer.telegram_id,
-                    self.translation.get_text(member_lang, "connect_instructions"),
-                    self.translation.get_text(member_lang, "subscription_link") % subscription_url,
+                    texts["duo_member_notification_title"] % buyer.telegram_id,
+                    texts["connect_instructions"],
+                    texts["subscription_link"] % subscription_url,
                 ]
             )
             try:
@@ -292,19 +298,21 @@ class PaymentService:
             is_trial_user=False,
             username=username,
         )
-        await self.customer_repo.update_fields(
-            customer.id,
-            {"subscription_link": user.subscription_url, "expire_at": user.expire_at.isoformat()},
+        _, refreshed_promo = await asyncio.gather(
+            self.customer_repo.update_fields(
+                customer.id,
+                {"subscription_link": user.subscription_url, "expire_at": user.expire_at.isoformat()},
+            ),
+            self.promo_repo.find_by_code(normalized_code),
         )
         try:
             await self.bot.send_message(
                 customer.telegram_id,
                 self.translation.get_text(customer.language, "promo_applied") % (promo.days, getattr(promo, "traffic_gb", 0)),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=self._connect_keyboard(customer.language)),
+                reply_markup=self._connect_markup(customer.language),
             )
         except Exception as err:  # noqa: BLE001
             logger.warning("failed to notify promo applied: %s", err)
-        refreshed_promo = await self.promo_repo.find_by_code(normalized_code)
         if refreshed_promo:
             promo = refreshed_promo
         await self._notify_owner_about_promo_activation(customer, promo, username, source)
@@ -335,16 +343,18 @@ class PaymentService:
             f"• <b>Источник:</b> <b>{html.escape(source_text)}</b>\n"
             f"• <b>Время (UTC):</b> <code>{datetime.utcnow().strftime('%d.%m.%Y %H:%M:%S')}</code>"
         )
-        for chat_id in chat_ids:
-            try:
-                await self.bot.send_message(chat_id, text, parse_mode="HTML")
-            except Exception as err:  # noqa: BLE001
+        results = await asyncio.gather(
+            *(self.bot.send_message(chat_id, text, parse_mode="HTML") for chat_id in chat_ids),
+            return_exceptions=True,
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
                 logger.warning(
                     "failed to notify chat=%s about promo activation code=%s customer=%s: %s",
                     chat_id,
                     promo.code,
                     customer.telegram_id,
-                    err,
+                    result,
                 )
 
     async def _maybe_grant_referral_bonus(self, customer: Customer) -> None:
@@ -379,7 +389,7 @@ class PaymentService:
             await self.bot.send_message(
                 referrer_customer.telegram_id,
                 self.translation.get_text(referrer_customer.language, "referral_bonus_granted") % purchase_days,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=self._connect_keyboard(referrer_customer.language)),
+                reply_markup=self._connect_markup(referrer_customer.language),
             )
         except Exception as err:  # noqa: BLE001
             logger.warning("failed to send referral bonus notification: %s", err)
@@ -456,22 +466,42 @@ class PaymentService:
         if is_gift:
             text += f"\n• <b>Даритель:</b> <code>{purchase.gift_sender_telegram_id}</code>"
         text += f"\n• <b>Время (UTC):</b> <code>{datetime.utcnow().strftime('%d.%m.%Y %H:%M:%S')}</code>"
-        for chat_id in chat_ids:
-            try:
-                await self.bot.send_message(chat_id, text, parse_mode="HTML")
-            except Exception as err:  # noqa: BLE001
-                logger.warning("failed to notify chat=%s about purchase=%s: %s", chat_id, purchase.id, err)
+        results = await asyncio.gather(
+            *(self.bot.send_message(chat_id, text, parse_mode="HTML") for chat_id in chat_ids),
+            return_exceptions=True,
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.warning("failed to notify chat=%s about purchase=%s: %s", chat_id, purchase.id, result)
+
+    def _connect_markup(self, lang: str) -> InlineKeyboardMarkup:
+        # Translations and mini_app_url are fixed after startup and aiogram markups are immutable,
+        # so one instance per language can be reused for every send.
+        markup = self._connect_markups.get(lang)
+        if markup is None:
+            markup = self._connect_markups[lang] = InlineKeyboardMarkup(inline_keyboard=self._connect_keyboard(lang))
+        return markup
 
     def _connect_keyboard(self, lang: str) -> List[List[InlineKeyboardButton]]:
+        texts = self.translation.get_many(
+            lang, ("connect_button", "back_button", "connect_button_emoji_id", "back_button_emoji_id")
+        )
+
+        def emoji_id(key: str) -> Optional[str]:
+            value = texts[f"{key}_emoji_id"]
+            if not value or value == f"{key}_emoji_id":
+                return None
+            return value
+
         buttons: List[List[InlineKeyboardButton]] = []
         if config.mini_app_url:
             buttons.append(
                 [
                     InlineKeyboardButton(
-                        text=self.translation.get_text(lang, "connect_button"),
+                        text=texts["connect_button"],
                         web_app={"url": config.mini_app_url},
                         style="primary",
-                        icon_custom_emoji_id=self._button_emoji_id(lang, "connect_button"),
+                        icon_custom_emoji_id=emoji_id("connect_button"),
                     )
                 ]
             )
@@ -479,15 +509,15 @@ class PaymentService:
             buttons.append(
                 [
                     InlineKeyboardButton(
-                        text=self.translation.get_text(lang, "connect_button"),
+                        text=texts["connect_button"],
                         callback_data="connect",
                         style="primary",
-                        icon_custom_emoji_id=self._button_emoji_id(lang, "connect_button"),
+                        icon_custom_emoji_id=emoji_id("connect_button"),
                     )
                 ]
             )
         buttons.append(
-            [InlineKeyboardButton(text=self.translation.get_text(lang, "back_button"), callback_data="start", style="primary", icon_custom_emoji_id=self._button_emoji_id(lang, "back_button"))]
+            [InlineKeyboardButton(text=texts["back_button"], callback_data="start", style="primary", icon_custom_emoji_id=emoji_id("back_button"))]
         )
         return buttons
 
@@ -558,7 +588,7 @@ class PaymentService:
             yookasa_url=None,
             yookasa_id=None,
         )
-        purchase_id = await self.purchase_repo.create(purchase)
+        purchase_id = (await self.purchase_repo.create(purchase)).id
         invoice = await self.crypto_client.create_invoice(
             {
                 "currency_type": "fiat",
@@ -579,6 +609,7 @@ class PaymentService:
                 "status": "pending",
             },
         )
+        self.invoice_created.set()
         url = invoice.get("bot_invoice_url") or invoice.get("botInvoiceUrl") or ""
         return url, purchase_id, None
 
@@ -604,7 +635,7 @@ class PaymentService:
             yookasa_url=None,
             yookasa_id=None,
         )
-        purchase_id = await self.purchase_repo.create(purchase)
+        purchase_id = (await self.purchase_repo.create(purchase)).id
         description = self.translation.get_text(customer.language, "invoice_description") or "VPN subscription"
         plan_label = self._format_plan_label(plan, months)
         description = f"{description} - {plan_label}"
@@ -639,6 +670,7 @@ class PaymentService:
                 "status": "pending",
             },
         )
+        self.invoice_created.set()
         return redirect_url or "", purchase_id, invoice
 
     async def _create_yookasa_invoice(
@@ -663,7 +695,7 @@ class PaymentService:
             yookasa_url=None,
             yookasa_id=None,
         )
-        purchase_id = await self.purchase_repo.create(purchase)
+        purchase_id = (await self.purchase_repo.create(purchase)).id
         invoice = await self.yookassa_client.create_invoice(
             int(amount), months, customer.id, purchase_id, username
         )
@@ -672,6 +704,7 @@ class PaymentService:
             purchase_id,
             {"yookasa_url": confirmation.get("confirmation_url"), "yookasa_id": invoice.get("id"), "status": "pending"},
         )
+        self.invoice_created.set()
         return confirmation.get("confirmation_url", ""), purchase_id, invoice
 
     async def _create_telegram_invoice(
@@ -694,7 +727,7 @@ class PaymentService:
             yookasa_url=None,
             yookasa_id=None,
         )
-        purchase_id = await self.purchase_repo.create(purchase)
+        purchase_id = (await self.purchase_repo.create(purchase)).id
         invoice_url = await self.bot.create_invoice_link(
             title=self.translation.get_text(customer.language, "invoice_title"),
             currency="XTR",
@@ -725,7 +758,7 @@ class PaymentService:
             yookasa_url=None,
             yookasa_id=None,
         )
-        purchase_id = await self.purchase_repo.create(purchase)
+        purchase_id = (await self.purchase_repo.create(purchase)).id
         return "", purchase_id, None
 
     async def refresh_customer_subscription(self, customer: Customer) -> Customer:
@@ -1057,8 +1090,7 @@ class StatsService:
     async def build_traffic_users_report_for_local_day(self, target_date: date) -> str:
         start_utc, end_utc = self._bounds_utc_for_local_day(target_date)
         new_users = await self.customer_repo.count_new_in_period(start_utc, end_utc)
-        paid_count = await self.sales_repo.count_paid_in_period(start_utc, end_utc)
-        new_paid_customers = await self.sales_repo.count_new_paid_customers_in_period(start_utc, end_utc)
+        paid_count, new_paid_customers = await self.sales_repo.paid_counts_in_period(start_utc, end_utc)
         renewals = max(0, paid_count - new_paid_customers)
 
         users = await self.remnawave_client.get_users()
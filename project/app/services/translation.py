@@ -1,6 +1,6 @@
 import json
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Sequence
 
 
 Translation = Dict[str, str]
@@ -32,3 +32,8 @@ class TranslationManager:
         default = self.translations.get(self.default_language, {})
         return default.get(key, key)
 
+    def get_many(self, lang_code: str, keys: Sequence[str]) -> Dict[str, str]:
+        """get_text for several keys, resolving the language tables once."""
+        table = self.translations.get(lang_code, {})
+        default = self.translations.get(self.default_language, {})
+        return {key: table.get(key) or default.get(key, key) for key in keys}